@@ -0,0 +1,91 @@
+#!/usr/bin/python3
+
+import os
+import pickle
+import hashlib
+import tempfile
+
+class defvals:
+    path = os.path.join(os.path.expanduser('~'), '.cache', 'tflite-graph')
+    size = 1024 # MB
+
+def file_hash(path):
+    h = hashlib.blake2b(digest_size=20)
+    with open(path, 'rb') as fd:
+        for chunk in iter(lambda: fd.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+def make_key(*parts):
+    h = hashlib.blake2b(digest_size=20)
+    for part in parts:
+        h.update(str(part).encode())
+        h.update(b'\0')
+    return h.hexdigest()
+
+# Directory of pickled entries, evicted least-recently-used first once over max_size bytes
+class Cache:
+    def __init__(self, path=None, max_size=None):
+        self.path = path or defvals.path
+        self.max_size = (defvals.size if max_size is None else max_size) << 20
+        os.makedirs(self.path, exist_ok=True)
+
+    def entry(self, key):
+        return os.path.join(self.path, key + '.pkl')
+
+    # content hash of a model, memoized by (path, size, mtime) to skip rehashing unchanged files
+    def model_hash(self, path):
+        st = os.stat(path)
+        stat_key = make_key(os.path.abspath(path), st.st_size, st.st_mtime_ns)
+        stat_entry = os.path.join(self.path, stat_key + '.hash')
+        try:
+            with open(stat_entry) as fd:
+                return fd.read()
+        except OSError:
+            pass
+        digest = file_hash(path)
+        self.write(stat_entry, digest.encode())
+        return digest
+
+    def get(self, key):
+        path = self.entry(key)
+        try:
+            with open(path, 'rb') as fd:
+                value = pickle.load(fd)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+        try:
+            os.utime(path) # LRU: mtime is the last access
+        except OSError:
+            pass # evicted by another worker meanwhile, the value is still good
+        return value
+
+    def put(self, key, value):
+        self.write(self.entry(key), pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+        self.evict()
+
+    def write(self, path, data):
+        fd, tmp = tempfile.mkstemp(dir=self.path, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path) # atomic for concurrent batch workers
+
+    def evict(self):
+        entries = []
+        for name in os.listdir(self.path):
+            if not name.endswith(('.pkl', '.hash')):
+                continue
+            try:
+                st = os.stat(os.path.join(self.path, name))
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, name))
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(os.path.join(self.path, name))
+            except OSError:
+                pass
+            total -= size
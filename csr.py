@@ -0,0 +1,14 @@
+#!/usr/bin/python3
+
+import numpy
+
+# CSR adjacency of unique (row, col) pairs, cols ascending within each row
+def csr(rows, cols, num_rows, num_cols):
+    keys = numpy.unique(rows.astype(numpy.int64) * num_cols + cols)
+    ptr = numpy.zeros(num_rows + 1, dtype=numpy.int64)
+    ptr[1:] = numpy.cumsum(numpy.bincount(keys // num_cols, minlength=num_rows))
+    return ptr, (keys % num_cols).astype(numpy.int32)
+
+# row of every entry of a CSR table
+def csr_rows(ptr):
+    return numpy.repeat(numpy.arange(len(ptr) - 1, dtype=numpy.int32), numpy.diff(ptr))
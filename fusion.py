@@ -1,91 +1,440 @@
 #!/usr/bin/python3
 
+import bisect
+import itertools
+import numpy
+from csr import csr_rows
+
 class defvals:
-    policy = 'fus_simple_no_branch'
-    #policy = 'fus_simple'
+    policy = 'fus_simple_no_branch' # any key of policies
+    sram_size = 1 << 20 # on-chip capacity for fused intermediates (fus_dram_dp), in bytes
+
+policies = {} # name -> policy(mp)
+
+def register(policy):
+    policies[policy.__name__] = policy
+    return policy
+
+# Builds fusion groups with O(1) per-op state: fused flags and counters of
+# unfused preds (pending) and of preds inside the group being built (in_grp)
+class GroupBuilder:
+    def __init__(self, mp):
+        self.mp = mp
+        self.pred_ptr = mp.op_pred_ptr.tolist()
+        self.succ_ptr = mp.op_succ_ptr.tolist()
+        self.succ = mp.op_succ.tolist()
+        self.fused = bytearray(len(mp.ops))
+        self.pending = [self.pred_ptr[i+1] - self.pred_ptr[i] for i in range(len(mp.ops))]
+        self.in_grp = [0] * len(mp.ops)
+        self.grp = []
+
+    def num_pred(self, idx):
+        return self.pred_ptr[idx+1] - self.pred_ptr[idx]
+
+    def num_succ(self, idx):
+        return self.succ_ptr[idx+1] - self.succ_ptr[idx]
+
+    def first_succ(self, idx):
+        return self.succ[self.succ_ptr[idx]] if self.num_succ(idx) else None
+
+    def succs(self, idx):
+        return self.succ[self.succ_ptr[idx]:self.succ_ptr[idx+1]]
+
+    # every pred is fused or in the current group
+    def is_ready(self, idx):
+        return self.pending[idx] == self.in_grp[idx]
+
+    def add(self, idx):
+        self.grp.append(idx)
+        if not self.fused[idx]:
+            for succ in self.succs(idx):
+                self.in_grp[succ] += 1
+
+    # drop the current group without fusing it
+    def discard(self):
+        grp = self.grp
+        for idx in grp:
+            if not self.fused[idx]:
+                for succ in self.succs(idx):
+                    self.in_grp[succ] -= 1
+        self.grp = []
+        return grp
+
+    def fuse(self, grp):
+        self.mp.add_fus_idxs(grp)
+        for idx in grp:
+            if not self.fused[idx]:
+                self.fused[idx] = 1
+                for succ in self.succs(idx):
+                    self.pending[succ] -= 1
+
+    def commit(self):
+        if self.grp:
+            self.fuse(self.discard())
 
+@register
 def fus_simple(mp):
-    fused = []
-    for op in mp.ops:
-        if op in fused:
+    gb = GroupBuilder(mp)
+    for idx in range(len(mp.ops)):
+        if gb.fused[idx]:
             continue
-        fus_grp = []
-        cur = op
-        while cur:
-            if len(cur.pred) > 1:
-                excluded = [pred for pred in cur.pred if pred not in fused and pred not in fus_grp]
-                if excluded:
-                    break
-            fus_grp.append(cur)
-            cur = cur.succ[0] if cur.succ else None
-        if fus_grp:
-            mp.add_fus_idxs([opx.idx for opx in fus_grp])
-            fused.extend(fus_grp)
+        cur = idx
+        while cur is not None:
+            if gb.num_pred(cur) > 1 and not gb.is_ready(cur):
+                break
+            gb.add(cur)
+            cur = gb.first_succ(cur)
+        gb.commit()
 
+@register
 def fus_simple_no_branch(mp):
-    fused = []
-    for op in mp.ops:
-        if op in fused:
+    gb = GroupBuilder(mp)
+    for idx in range(len(mp.ops)):
+        if gb.fused[idx]:
+            continue
+        cur = idx
+        while cur is not None:
+            if gb.num_pred(cur) > 1 and not gb.is_ready(cur):
+                break
+            gb.add(cur)
+            if gb.num_succ(cur) > 1:
+                break
+            cur = gb.first_succ(cur)
+        gb.commit()
+
+# (saved, onchip) bytes of fusing op a into its successor b, following dram_traffic:
+# b's reads of a's outputs are saved, a's writes are saved if b is the only consumer
+def edge_cost(mp, a, b, is_output):
+    saved = 0
+    onchip = {}
+    for x in mp.op_inputs[mp.op_inputs_ptr[b]:mp.op_inputs_ptr[b+1]].tolist():
+        if mp.tensor_prod[x] == a:
+            saved += int(mp.tensor_bytes[x])
+            onchip[x] = int(mp.tensor_bytes[x])
+    for x in mp.op_outputs[mp.op_outputs_ptr[a]:mp.op_outputs_ptr[a+1]].tolist():
+        ptr = mp.tensor_tail_ptr[x]
+        if mp.tensor_tail_ptr[x+1] - ptr == 1 and mp.tensor_tail[ptr] == b and not is_output[x]:
+            saved += int(mp.tensor_bytes[x])
+    return saved, sum(onchip.values())
+
+# DP over the edges of a chain: fuse a subset of edges maximizing the saved traffic while
+# the intermediates around every op (fused in-edge + fused out-edge) fit in capacity.
+# Returns the positions where a new group starts.
+def split_chain(gains, weights, capacity):
+    NONE = -1
+    score = [0, NONE] # best gain with the last edge unfused / fused
+    back = []
+    for k in range(len(gains)):
+        prev = weights[k-1] if k else 0
+        from_unfused = score[0] + gains[k]
+        from_fused = score[1] + gains[k] if score[1] != NONE and prev + weights[k] <= capacity else NONE
+        fused = NONE
+        if weights[k] <= capacity:
+            fused = max(from_unfused, from_fused)
+        back.append((1 if score[1] >= score[0] else 0, 1 if from_fused >= from_unfused else 0))
+        score = [max(score), fused]
+    state = 1 if score[1] >= score[0] else 0
+    cuts = []
+    for k in range(len(gains) - 1, -1, -1):
+        if not state:
+            cuts.append(k + 1)
+        state = back[k][state]
+    return cuts[::-1]
+
+# Chains are walked as in fus_simple, then split where keeping intermediates on chip
+# would overflow defvals.sram_size or does not save DRAM traffic. Split-off groups are
+# only fused once the walk reaches their 1st op, so groups stay valid in 1st-op order.
+@register
+def fus_dram_dp(mp):
+    gb = GroupBuilder(mp)
+    is_output = output_mask(mp)
+    reserved = bytearray(len(mp.ops))
+    pieces = {} # 1st op idx -> group split off an earlier chain
+    for idx in range(len(mp.ops)):
+        if idx in pieces:
+            gb.fuse(pieces.pop(idx))
+            continue
+        if gb.fused[idx] or reserved[idx]:
             continue
-        fus_grp = []
-        cur = op
-        while cur:
-            if len(cur.pred) > 1:
-                excluded = [pred for pred in cur.pred if pred not in fused and pred not in fus_grp]
-                if excluded:
-                    break
-            if len(cur.succ) > 1:
-                fus_grp.append(cur)
+        cur = idx
+        while cur is not None and not gb.fused[cur] and not reserved[cur]:
+            if gb.num_pred(cur) > 1 and not gb.is_ready(cur):
                 break
-            fus_grp.append(cur)
-            cur = cur.succ[0] if cur.succ else None
-        if fus_grp:
-            mp.add_fus_idxs([opx.idx for opx in fus_grp])
-            fused.extend(fus_grp)
+            gb.add(cur)
+            cur = gb.first_succ(cur)
+        grp = gb.discard()
+        costs = [edge_cost(mp, a, b, is_output) for a, b in zip(grp[:-1], grp[1:])]
+        bounds = [0] + split_chain([x[0] for x in costs], [x[1] for x in costs], defvals.sram_size) + [len(grp)]
+        gb.fuse(grp[:bounds[1]])
+        for start, end in zip(bounds[1:-1], bounds[2:]):
+            pieces[grp[start]] = grp[start:end]
+            for x in grp[start:end]:
+                reserved[x] = 1
 
-def do_fusion(mp):
-    eval('%s(mp)' %(defvals.policy))
+def do_fusion(mp, policy=None):
+    policies[policy or defvals.policy](mp)
 
 def caculate_dram_usage(mp):
-    total = 0
-    total_fus = 0
-    for op in mp.ops:
-        size = 0
-        size_fus = 0
-        fus_grp = op.fus_org.fus_grp if op.fus_org else op.fus_grp
-        fus_pred = None
-        fus_succ = None
-        dram_rd = []
-        dram_wr = []
-        if len(fus_grp) > 1:
-            grp_idx = fus_grp.index(op)
-            fus_pred = fus_grp[grp_idx - 1] if grp_idx else None
-            fus_succ = fus_grp[grp_idx + 1] if grp_idx < len(fus_grp) - 1 else None
-        for x in op.inputs:
-            if x.head: # Only I/O tensors
-                sz = x.size()
-                size += sz
-                if x.head != fus_pred:
-                    size_fus += sz
-                    dram_rd.append(x)
-        for x in op.outputs:
-            if x.head: # Only I/O tensors
-                sz = x.size()
-                size += sz
-                if x.tail[0] != fus_succ or len(x.tail) > 1:
-                    size_fus += sz
-                    dram_wr.append(x)
-
-        # Debug
-        if dram_rd or dram_wr:
+    return caculate_dram_traffic(mp).ratio()
+
+def caculate_dram_traffic(mp, verbose=False):
+    traffic = dram_traffic(mp)
+    if verbose:
+        for record in traffic.records(mp):
             strs = []
-            if dram_rd:
-                strs.append('rd ' + ','.join([str(x) for x in dram_rd]))
-            if dram_wr:
-                strs.append('wr ' + ','.join([str(x) for x in dram_wr]))
-            print('%s: %s' %(str(op), ', '.join(strs)))
+            if record['rd']:
+                strs.append('rd ' + ','.join([str(mp.tensors[x]) for x in record['rd']]))
+            if record['wr']:
+                strs.append('wr ' + ','.join([str(mp.tensors[x]) for x in record['wr']]))
+            if strs:
+                print('%s: %s' %(record['name'], ', '.join(strs)))
+    return traffic
+
+# Per-op DRAM bytes without fusion (rd, wr) and with fusion (rd_fus, wr_fus).
+# rd includes wt: weights and constants, with their quantization parameters.
+class DramTraffic:
+    def __init__(self, num_ops):
+        self.num_ops = num_ops
+        # one entry per op input / output, in op order (rd_ptr / wr_ptr: CSR offsets)
+        self.rd_ptr = self.rd_op = self.rd_tensor = self.rd_bytes = self.rd_dram = None
+        self.wr_ptr = self.wr_op = self.wr_tensor = self.wr_bytes = self.wr_dram = None
+        self.rd_prod = None # producer op of the tensor read
+        self.wr_only = None # only consumer op of the tensor written if it may stay on chip (-1: none)
+        # per op
+        self.rd = self.wr = self.wt = self.rd_fus = self.wr_fus = None
+
+    def sum_by_op(self, ops, vals):
+        return numpy.bincount(ops, weights=vals, minlength=self.num_ops).round().astype(numpy.int64)
+
+    def update(self):
+        self.rd = self.sum_by_op(self.rd_op, self.rd_bytes)
+        self.wr = self.sum_by_op(self.wr_op, self.wr_bytes)
+        self.rd_fus = self.sum_by_op(self.rd_op, self.rd_bytes * self.rd_dram)
+        self.wr_fus = self.sum_by_op(self.wr_op, self.wr_bytes * self.wr_dram)
+
+    def total(self):
+        return int(self.rd.sum() + self.wr.sum())
+
+    def total_fus(self):
+        return int(self.rd_fus.sum() + self.wr_fus.sum())
+
+    def ratio(self):
+        total = self.total()
+        return float(self.total_fus()) / total if total else 0.0
+
+    # tensors an op still reads from / writes to DRAM with fusion
+    def dram_tensors(self, op_idx):
+        rd = slice(self.rd_ptr[op_idx], self.rd_ptr[op_idx+1])
+        wr = slice(self.wr_ptr[op_idx], self.wr_ptr[op_idx+1])
+        return self.rd_tensor[rd][self.rd_dram[rd]].tolist(), self.wr_tensor[wr][self.wr_dram[wr]].tolist()
+
+    # one dict per op: DRAM tensors and bytes with fusion, for JSON / CSV reports
+    def records(self, mp):
+        records = []
+        for op in mp.ops:
+            rd, wr = self.dram_tensors(op.idx)
+            records.append({
+                'op': op.idx,
+                'name': str(op),
+                'rd': rd,
+                'wr': wr,
+                'rd_bytes': int(self.rd_fus[op.idx]),
+                'wr_bytes': int(self.wr_fus[op.idx]),
+                'wt_bytes': int(self.wt[op.idx]),
+            })
+        return records
+
+def output_mask(mp):
+    is_output = numpy.zeros(len(mp.tensor_size), dtype=bool)
+    is_output[mp.graph_outputs] = True
+    return is_output
+
+# op idx before / after each op inside its own fusion group (-1: none)
+def fus_links(mp):
+    num_ops = len(mp.ops)
+    fus_prev = numpy.full(num_ops, -1, dtype=numpy.int64)
+    fus_next = numpy.full(num_ops, -1, dtype=numpy.int64)
+    grps = [(org, grp) for org, grp in mp.fus_grps.items() if len(grp) > 1]
+    if not grps:
+        return fus_prev, fus_next
+    lens = numpy.array([len(grp) for _, grp in grps])
+    members = numpy.fromiter(itertools.chain.from_iterable(grp for _, grp in grps), dtype=numpy.int64, count=lens.sum())
+    orgs = numpy.repeat([org for org, _ in grps], lens)
+    pos = numpy.arange(len(members)) - numpy.repeat(numpy.cumsum(lens) - lens, lens)
+    prev_op = numpy.where(pos > 0, numpy.roll(members, 1), -1)
+    next_op = numpy.where(pos < numpy.repeat(lens, lens) - 1, numpy.roll(members, -1), -1)
+    # ops fused into another group belong to their fus_org's group
+    own = (mp.fus_org[members] == orgs) | ((members == orgs) & (mp.fus_org[members] < 0))
+    fus_prev[members[own]] = prev_op[own]
+    fus_next[members[own]] = next_op[own]
+    return fus_prev, fus_next
+
+def dram_traffic(mp):
+    num_ops = len(mp.ops)
+    fus_prev, fus_next = fus_links(mp)
+    traffic = DramTraffic(num_ops)
+
+    # reads: every input, weights included; skipped if produced by the previous fused op
+    rd_op = csr_rows(mp.op_inputs_ptr)
+    rd_tensor = mp.op_inputs
+    const = mp.tensor_const[rd_tensor]
+    rd_bytes = mp.tensor_bytes[rd_tensor] + numpy.where(const, mp.tensor_qbytes[rd_tensor], 0)
+    rd_prev = fus_prev[rd_op]
+    traffic.rd_prod = mp.tensor_prod[rd_tensor]
+    traffic.rd_dram = ~((rd_prev >= 0) & (traffic.rd_prod == rd_prev))
+    traffic.wt = traffic.sum_by_op(rd_op, rd_bytes * const)
+
+    # writes: every output; skipped if only the next fused op consumes it and it is not a graph output
+    wr_op = csr_rows(mp.op_outputs_ptr)
+    wr_tensor = mp.op_outputs
+    wr_bytes = mp.tensor_bytes[wr_tensor]
+    wr_next = fus_next[wr_op]
+    ptr = mp.tensor_tail_ptr[wr_tensor]
+    single = (mp.tensor_tail_ptr[wr_tensor + 1] - ptr) == 1
+    first = numpy.append(mp.tensor_tail, -1)[ptr] # only consumer if single
+    traffic.wr_only = numpy.where(single & ~output_mask(mp)[wr_tensor], first, -1)
+    traffic.wr_dram = ~((wr_next >= 0) & (traffic.wr_only == wr_next))
+
+    traffic.rd_ptr, traffic.rd_op, traffic.rd_tensor, traffic.rd_bytes = mp.op_inputs_ptr, rd_op, rd_tensor, rd_bytes
+    traffic.wr_ptr, traffic.wr_op, traffic.wr_tensor, traffic.wr_bytes = mp.op_outputs_ptr, wr_op, wr_tensor, wr_bytes
+    traffic.update()
+    return traffic
+
+# Fusion groups edited one merge / split at a time, with DRAM bytes per op and group and the
+# dependency checks of tflite_ut kept current. Only the ops whose in-group neighbors or group
+# change are revisited; mp.fus_grps / mp.fus_org are updated in place.
+class FusionTracker:
+    def __init__(self, mp):
+        self.mp = mp
+        num_ops = len(mp.ops)
+        self.succ_ptr = mp.op_succ_ptr.tolist()
+        self.succ = mp.op_succ.tolist()
+        self.pred_ptr = mp.op_pred_ptr.tolist()
+        self.pred = mp.op_pred.tolist()
+        fus_prev, fus_next = fus_links(mp)
+        self.fus_prev = fus_prev.tolist()
+        self.fus_next = fus_next.tolist()
+        self.traffic = dram_traffic(mp)
+        op_dram = self.traffic.rd_fus + self.traffic.wr_fus
+        self.dram = int(op_dram.sum())
+
+        # group (1st op idx) and position in it of every op
+        key = mp.group_keys()
+        self.key = key.tolist()
+        self.pos = [0] * num_ops
+        for org_idx, grp in mp.fus_grps.items():
+            for i, x in enumerate(grp):
+                if self.key[x] == org_idx:
+                    self.pos[x] = i
+        orgs, inverse = numpy.unique(key, return_inverse=True)
+        self.grp_dram = dict(zip(orgs.tolist(), numpy.bincount(inverse, weights=op_dram).astype(numpy.int64).tolist()))
+
+        # pred -> succ edges run in the wrong order, fused neighbors not linked by an edge
+        src = csr_rows(mp.op_succ_ptr).astype(numpy.int64)
+        dst = mp.op_succ
+        pos = numpy.array(self.pos)
+        ok = (key[src] < key[dst]) | ((key[src] == key[dst]) & (pos[src] < pos[dst]))
+        self.num_order = int(numpy.count_nonzero(~ok))
+        linked = numpy.flatnonzero(fus_next >= 0)
+        self.num_unlinked = int(numpy.count_nonzero(~numpy.isin(linked * num_ops + fus_next[linked], src * num_ops + dst)))
+
+    def group(self, org_idx):
+        return self.mp.fus_grps.get(org_idx, [org_idx])
+
+    def total_fus(self):
+        return self.dram
+
+    def ratio(self):
+        total = self.traffic.total()
+        return float(self.dram) / total if total else 0.0
+
+    def is_valid(self):
+        return self.num_order == 0 and self.num_unlinked == 0
+
+    def has_edge(self, a, b):
+        hi = self.succ_ptr[a+1]
+        i = bisect.bisect_left(self.succ, b, self.succ_ptr[a], hi)
+        return i < hi and self.succ[i] == b
+
+    def ordered(self, a, b):
+        return self.key[a] < self.key[b] or (self.key[a] == self.key[b] and self.pos[a] < self.pos[b])
+
+    # edges touching ops
+    def edges(self, ops):
+        edges = set()
+        for x in ops:
+            edges.update([(p, x) for p in self.pred[self.pred_ptr[x]:self.pred_ptr[x+1]]])
+            edges.update([(x, s) for s in self.succ[self.succ_ptr[x]:self.succ_ptr[x+1]]])
+        return edges
+
+    # moves ops to group org_idx from position start on, recounting the edges around them
+    def relabel(self, ops, org_idx, start):
+        edges = self.edges(ops)
+        self.num_order -= sum([not self.ordered(a, b) for a, b in edges])
+        for i, x in enumerate(ops):
+            self.key[x] = org_idx
+            self.pos[x] = start + i
+        self.num_order += sum([not self.ordered(a, b) for a, b in edges])
+
+    # DRAM reads / writes of op_idx after its fused neighbors changed, returns the change in bytes
+    def update_op(self, op_idx):
+        t = self.traffic
+        old = int(t.rd_fus[op_idx] + t.wr_fus[op_idx])
+        rd = slice(t.rd_ptr[op_idx], t.rd_ptr[op_idx+1])
+        prev = self.fus_prev[op_idx]
+        t.rd_dram[rd] = ~((prev >= 0) & (t.rd_prod[rd] == prev))
+        t.rd_fus[op_idx] = round(float(numpy.dot(t.rd_bytes[rd], t.rd_dram[rd])))
+        wr = slice(t.wr_ptr[op_idx], t.wr_ptr[op_idx+1])
+        next_idx = self.fus_next[op_idx]
+        t.wr_dram[wr] = ~((next_idx >= 0) & (t.wr_only[wr] == next_idx))
+        t.wr_fus[op_idx] = round(float(numpy.dot(t.wr_bytes[wr], t.wr_dram[wr])))
+        delta = int(t.rd_fus[op_idx] + t.wr_fus[op_idx]) - old
+        self.dram += delta
+        return delta
+
+    # fused neighbors a -> b (-1: none), returns the change in DRAM bytes
+    def link(self, a, b, linked):
+        if linked:
+            self.num_unlinked += not self.has_edge(a, b)
+            self.fus_next[a], self.fus_prev[b] = b, a
+        else:
+            self.num_unlinked -= not self.has_edge(a, b)
+            self.fus_next[a], self.fus_prev[b] = -1, -1
+        return self.update_op(a) + self.update_op(b)
+
+    # appends group b to group a
+    def merge(self, org_a, org_b):
+        if self.key[org_a] != org_a or self.key[org_b] != org_b or org_a == org_b:
+            raise ValueError('%d, %d: not two fusion groups' %(org_a, org_b))
+        mp = self.mp
+        grp_a = mp.fus_grps.setdefault(org_a, [org_a])
+        grp_b = mp.fus_grps.pop(org_b, [org_b])
+        self.relabel(grp_b, org_a, len(grp_a))
+        delta = self.link(grp_a[-1], grp_b[0], True)
+        grp_a.extend(grp_b)
+        mp.fus_org[grp_b] = org_a
+        self.grp_dram[org_a] += self.grp_dram.pop(org_b) + delta
 
-        total += size
-        total_fus += size_fus
-    return float(total_fus) / float(total)
+    # splits a group before its pos-th op, which starts a new group
+    def split(self, org_idx, pos):
+        grp = self.group(org_idx)
+        if self.key[org_idx] != org_idx or not 0 < pos < len(grp):
+            raise ValueError('%d: no fusion group to split at %d' %(org_idx, pos))
+        mp = self.mp
+        head, tail = grp[:pos], grp[pos:]
+        self.relabel(tail, tail[0], 0)
+        delta = self.link(head[-1], tail[0], False)
+        mp.fus_grps[org_idx] = head
+        mp.fus_grps[tail[0]] = tail
+        mp.fus_org[tail[0]] = -1
+        mp.fus_org[tail[1:]] = tail[0]
+        t = self.traffic
+        self.grp_dram[tail[0]] = int(t.rd_fus[tail].sum() + t.wr_fus[tail].sum())
+        self.grp_dram[org_idx] += delta - self.grp_dram[tail[0]]
 
+    # ModelParser.add_fus_idxs on top of unfused ops or existing groups
+    def add_fus_idxs(self, idxs):
+        org_idx = int(idxs[0])
+        for cur_idx in map(int, idxs[1:]):
+            if self.key[cur_idx] != org_idx:
+                self.merge(org_idx, cur_idx)
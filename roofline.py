@@ -0,0 +1,107 @@
+#!/usr/bin/python3
+
+import numpy
+import tflite
+
+class defvals:
+    peak_gmacs = 1024.0 # GMAC/s
+    bandwidth = 16.0 # GB/s
+
+ops = tflite.BuiltinOperator
+
+# MACs = size(base) * size(weights) / weights.shape[axis], base: input position or -1 for the output
+weighted_ops = {
+    ops.CONV_2D: (-1, 1, 0), # [Cout, kh, kw, Cin]
+    ops.CONV_3D: (-1, 1, -1), # [kd, kh, kw, Cin, Cout]
+    ops.DEPTHWISE_CONV_2D: (-1, 1, -1), # [1, kh, kw, Cout]
+    ops.FULLY_CONNECTED: (-1, 1, 0), # [units, K]
+    ops.TRANSPOSE_CONV: (2, 1, -1), # inputs: output shape, [Cout, kh, kw, Cin], input
+}
+
+# one MAC per output element
+elementwise_ops = {
+    ops.ADD, ops.SUB, ops.MUL, ops.DIV, ops.MAXIMUM, ops.MINIMUM, ops.SQUARED_DIFFERENCE, ops.POW,
+    ops.RELU, ops.RELU6, ops.RELU_N1_TO_1, ops.LEAKY_RELU, ops.PRELU, ops.ELU, ops.GELU, ops.HARD_SWISH,
+    ops.LOGISTIC, ops.TANH, ops.ABS, ops.NEG, ops.EXP, ops.LOG, ops.SQRT, ops.RSQRT, ops.FLOOR,
+    ops.QUANTIZE, ops.DEQUANTIZE,
+}
+
+# one MAC per input element
+reduce_ops = {
+    ops.AVERAGE_POOL_2D, ops.MAX_POOL_2D, ops.L2_POOL_2D, ops.MEAN, ops.SUM, ops.REDUCE_MAX, ops.REDUCE_MIN,
+    ops.SOFTMAX, ops.LOG_SOFTMAX, ops.L2_NORMALIZATION,
+}
+
+# n-th tensor of every op from a CSR table (-1: none)
+def nth_tensor(ptr, idx, n):
+    pos = ptr[:-1] + n
+    valid = pos < ptr[1:]
+    return numpy.where(valid, numpy.append(idx, -1)[numpy.where(valid, pos, len(idx))], -1)
+
+# other ops (reshape, concatenation, ...) only move data: 0 MACs
+def op_macs(mp):
+    num_ops = len(mp.op_codes)
+    size = numpy.append(mp.tensor_size, 0) # [-1]: no tensor
+    rank = numpy.append(mp.tensor_rank, 1)
+    shape = numpy.vstack([mp.tensor_shape, numpy.ones((1, mp.tensor_shape.shape[1]), dtype=mp.tensor_shape.dtype)])
+    def dim(t, axis):
+        return shape[t, axis if axis >= 0 else rank[t] + axis].astype(numpy.int64)
+    def inputs(n):
+        return nth_tensor(mp.op_inputs_ptr, mp.op_inputs, n)
+    out = nth_tensor(mp.op_outputs_ptr, mp.op_outputs, 0)
+    macs = numpy.zeros(num_ops, dtype=numpy.int64)
+    for op_code, (base, weights, axis) in weighted_ops.items():
+        sel = numpy.flatnonzero(mp.op_codes == op_code)
+        b = out[sel] if base < 0 else inputs(base)[sel]
+        w = inputs(weights)[sel]
+        macs[sel] = numpy.where(w >= 0, size[b] * size[w] // numpy.maximum(dim(w, axis), 1), 0)
+    sel = numpy.flatnonzero(mp.op_codes == ops.BATCH_MATMUL) # out * K, input 0 [..., M, K] or [..., K, M] (adj_x)
+    adj_x = numpy.array([mp.op_adj_x.get(x, False) for x in sel.tolist()], dtype=bool)
+    macs[sel] = size[out[sel]] * numpy.where(adj_x, dim(inputs(0)[sel], -2), dim(inputs(0)[sel], -1))
+    sel = numpy.isin(mp.op_codes, list(elementwise_ops))
+    macs[sel] = size[out][sel]
+    sel = numpy.isin(mp.op_codes, list(reduce_ops))
+    macs[sel] = size[inputs(0)][sel]
+    return macs
+
+# Latency of each fusion group: max(MACs / peak compute, DRAM bytes / bandwidth)
+class Roofline:
+    def __init__(self, mp, traffic, peak_gmacs=None, bandwidth=None):
+        self.peak = (peak_gmacs or defvals.peak_gmacs) * 1e9 # MAC/s
+        self.bandwidth = (bandwidth or defvals.bandwidth) * 1e9 # bytes/s
+        self.macs = op_macs(mp)
+        # per op without fusion
+        self.op_latency = numpy.maximum(self.macs / self.peak, (traffic.rd + traffic.wr) / self.bandwidth)
+        # per group, one group per op not fused anywhere
+        self.grp_org, grp = numpy.unique(mp.group_keys(), return_inverse=True)
+        self.grp_ops = numpy.bincount(grp, minlength=len(self.grp_org))
+        self.grp_macs = numpy.bincount(grp, weights=self.macs, minlength=len(self.grp_org))
+        self.grp_dram = numpy.bincount(grp, weights=traffic.rd_fus + traffic.wr_fus, minlength=len(self.grp_org))
+        self.grp_compute = self.grp_macs / self.peak
+        self.grp_memory = self.grp_dram / self.bandwidth
+        self.grp_latency = numpy.maximum(self.grp_compute, self.grp_memory)
+
+    def latency(self):
+        return float(self.grp_latency.sum())
+
+    def latency_nofus(self):
+        return float(self.op_latency.sum())
+
+    def bound(self, grp_idx):
+        return 'compute' if self.grp_compute[grp_idx] >= self.grp_memory[grp_idx] else 'bandwidth'
+
+    def num_compute_bound(self):
+        return int(numpy.count_nonzero(self.grp_compute >= self.grp_memory))
+
+    def records(self, mp):
+        records = []
+        for i, org_idx in enumerate(self.grp_org.tolist()):
+            records.append({
+                'group': str(mp.ops[org_idx]),
+                'ops': int(self.grp_ops[i]),
+                'macs': int(self.grp_macs[i]),
+                'dram_bytes': int(self.grp_dram[i]),
+                'latency_us': float(self.grp_latency[i]) * 1e6,
+                'bound': self.bound(i),
+            })
+        return records
@@ -0,0 +1,164 @@
+#!/usr/bin/python3
+
+import heapq
+import numpy
+from csr import csr, csr_rows
+
+class defvals:
+    alignment = 16 # arena offsets, bytes
+
+# Fusion groups as nodes, activations exchanged between groups as edges.
+# Tensors inside a group never reach the arena; weights are not activations.
+class GroupGraph:
+    def __init__(self, mp):
+        num_tensors = len(mp.tensor_size)
+        self.grp_org, grp = numpy.unique(mp.group_keys(), return_inverse=True)
+        num_grps = len(self.grp_org)
+        tensor_grp = numpy.append(grp, -1)[mp.tensor_prod] # producer group (-1: none)
+
+        # inputs: (group, tensor) for every activation read across a group boundary
+        op = csr_rows(mp.op_inputs_ptr)
+        t = mp.op_inputs.astype(numpy.int64)
+        cross = (tensor_grp[t] != grp[op]) & ~mp.tensor_const[t]
+        keys = numpy.unique(grp[op][cross] * num_tensors + t[cross])
+        in_grp, in_tensor = keys // num_tensors, keys % num_tensors
+
+        # arena tensors: read by another group, or graph outputs
+        outputs = mp.graph_outputs[~mp.tensor_const[mp.graph_outputs]]
+        self.tensors = numpy.union1d(in_tensor, outputs)
+        self.tensor_grp = tensor_grp[self.tensors]
+        self.is_output = numpy.isin(self.tensors, outputs)
+        local = numpy.searchsorted(self.tensors, in_tensor) # into self.tensors
+        self.in_ptr, self.ins = self.lists(csr(in_grp, local, num_grps, len(self.tensors)))
+        self.cons_ptr, self.cons = self.lists(csr(local, in_grp, len(self.tensors), num_grps))
+        produced = self.tensor_grp >= 0
+        self.out_ptr, self.outs = self.lists(csr(self.tensor_grp[produced], numpy.flatnonzero(produced), num_grps, len(self.tensors)))
+
+        # group dependencies
+        dep = numpy.unique(tensor_grp[in_tensor] * num_grps + in_grp)
+        dep = dep[dep >= 0]
+        self.num_pred = numpy.bincount(dep % num_grps, minlength=num_grps).tolist()
+        self.succ_ptr, self.succ = self.lists(csr(dep // num_grps, dep % num_grps, num_grps, num_grps))
+
+    @staticmethod
+    def lists(table): # CSR as lists, for scalar walks
+        return table[0].tolist(), table[1].tolist()
+
+    def inputs(self, g):
+        return self.ins[self.in_ptr[g]:self.in_ptr[g+1]]
+
+    def outputs(self, g):
+        return self.outs[self.out_ptr[g]:self.out_ptr[g+1]]
+
+    def consumers(self, t):
+        return self.cons[self.cons_ptr[t]:self.cons_ptr[t+1]]
+
+    def successors(self, g):
+        return self.succ[self.succ_ptr[g]:self.succ_ptr[g+1]]
+
+# Topological order of groups, each step picking the ready group that grows live memory the least:
+# bytes it allocates minus bytes of inputs it is the last consumer of (ties: model order)
+def min_memory_order(gg, nbytes):
+    num_grps = len(gg.grp_org)
+    remaining = [len(gg.consumers(t)) + int(gg.is_output[t]) for t in range(len(gg.tensors))]
+    num_pred = list(gg.num_pred)
+    done = bytearray(num_grps)
+    key = [None] * num_grps
+
+    def delta(g):
+        freed = sum(nbytes[t] for t in gg.inputs(g) if remaining[t] == 1)
+        return sum(nbytes[t] for t in gg.outputs(g)) - freed
+
+    def push(g):
+        key[g] = delta(g)
+        heapq.heappush(heap, (key[g], g))
+
+    heap = []
+    for g in range(num_grps):
+        if num_pred[g] == 0:
+            push(g)
+    order = []
+    while heap:
+        d, g = heapq.heappop(heap)
+        if done[g] or d != key[g]:
+            continue # stale
+        done[g] = 1
+        order.append(g)
+        for t in gg.inputs(g):
+            remaining[t] -= 1
+            if remaining[t] == 1: # the last consumer now frees t
+                for c in gg.consumers(t):
+                    if not done[c] and num_pred[c] == 0:
+                        push(c)
+        for s in gg.successors(g):
+            num_pred[s] -= 1
+            if num_pred[s] == 0:
+                push(s)
+    if len(order) != num_grps:
+        raise ValueError('fusion groups form a cycle, %d of %d groups scheduled' %(len(order), num_grps))
+    return order
+
+# Offsets for tensors live over [start, end] steps: largest first, at the lowest gap free over its lifetime
+def greedy_by_size(start, end, size, alignment=None):
+    alignment = alignment or defvals.alignment
+    size = (size + alignment - 1) // alignment * alignment
+    offset = numpy.zeros(len(size), dtype=numpy.int64)
+    by_size = numpy.argsort(-size, kind='stable')
+    for i, t in enumerate(by_size):
+        placed = by_size[:i]
+        live = placed[(start[placed] <= end[t]) & (end[placed] >= start[t])]
+        cur = 0
+        for x in live[numpy.argsort(offset[live], kind='stable')]:
+            if offset[x] - cur >= size[t]:
+                break
+            cur = max(cur, offset[x] + size[x])
+        offset[t] = cur
+    arena = int((offset + size).max()) if len(size) else 0
+    return offset, arena
+
+# Group order, tensor lifetimes and arena offsets. The greedy order is myopic and
+# only kept when it lowers peak live memory below model order.
+class Schedule:
+    def __init__(self, mp, natural=False):
+        self.gg = GroupGraph(mp)
+        self.nbytes = mp.tensor_bytes[self.gg.tensors].astype(numpy.int64)
+        orders = [list(range(len(self.gg.grp_org)))]
+        if not natural:
+            orders.append(min_memory_order(self.gg, self.nbytes.tolist()))
+        lifetimes = [self.lifetimes(order) for order in orders]
+        peaks = [int(live.max()) if len(live) else 0 for _, _, live in lifetimes]
+        best = peaks.index(min(peaks))
+        self.order = orders[best]
+        self.start, self.end, self.live = lifetimes[best]
+        self.offset, self.arena = greedy_by_size(self.start, self.end, self.nbytes)
+
+    # producer step (graph inputs: 0) .. last consumer step (graph outputs: last step), live bytes per step
+    def lifetimes(self, order):
+        gg = self.gg
+        num_grps = len(order)
+        step = numpy.empty(num_grps, dtype=numpy.int64)
+        step[order] = numpy.arange(num_grps)
+        start = numpy.where(gg.tensor_grp >= 0, step[gg.tensor_grp], 0)
+        end = start.copy()
+        numpy.maximum.at(end, csr_rows(numpy.array(gg.cons_ptr)), step[numpy.array(gg.cons, dtype=numpy.int64)])
+        end[gg.is_output] = max(num_grps - 1, 0)
+        live = numpy.zeros(num_grps + 1, dtype=numpy.int64)
+        numpy.add.at(live, start, self.nbytes)
+        numpy.add.at(live, end + 1, -self.nbytes)
+        return start, end, numpy.cumsum(live)[:num_grps]
+
+    def peak_live(self):
+        return int(self.live.max()) if len(self.live) else 0
+
+    def records(self, mp):
+        records = []
+        for i, t in enumerate(self.gg.tensors.tolist()):
+            records.append({
+                'tensor': t,
+                'shape': str(mp.tensors[t]),
+                'bytes': int(self.nbytes[i]),
+                'first': int(self.start[i]),
+                'last': int(self.end[i]),
+                'offset': int(self.offset[i]),
+            })
+        return records
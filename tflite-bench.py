@@ -0,0 +1,203 @@
+#!/usr/bin/python3
+
+import io
+import os
+import sys
+import time
+import random
+import tempfile
+import argparse
+import contextlib
+import importlib.util
+
+import tflite_gen
+import fusion
+
+def load_tflite_graph():
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tflite-graph.py')
+    spec = importlib.util.spec_from_file_location('tflite_graph', path)
+    mod = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = mod # pool workers unpickle analyze_subgraph_job by module name
+    spec.loader.exec_module(mod)
+    return mod
+
+def bench_parse(tg, buf):
+    mp = tg.ModelParser(argparse.Namespace(model=None))
+    mp.load_buffer(buf)
+    start = time.perf_counter()
+    mp.parse_subgraph()
+    return mp, time.perf_counter() - start
+
+def bench_fusion(mp, policy):
+    mp.reset_fusion()
+    start = time.perf_counter()
+    fusion.policies[policy](mp)
+    return time.perf_counter() - start
+
+def bench_dram(mp):
+    start = time.perf_counter()
+    fusion.caculate_dram_usage(mp)
+    return time.perf_counter() - start
+
+# fus_dram_dp: the intermediates on chip around every fused op (in-edge + out-edge) fit defvals.sram_size
+def check_budget(mp):
+    errcnt = 0
+    is_output = fusion.output_mask(mp)
+    for grp in mp.fus_grps.values():
+        onchip = [fusion.edge_cost(mp, a, b, is_output)[1] for a, b in zip(grp[:-1], grp[1:])]
+        for k in range(len(onchip)):
+            if (onchip[k-1] if k else 0) + onchip[k] > fusion.defvals.sram_size:
+                print('ERROR: %s fused over %d bytes of sram, %d + %d on chip' %(mp.ops[grp[k+1]].nodename(),
+                    fusion.defvals.sram_size, onchip[k-1] if k else 0, onchip[k]))
+                errcnt += 1
+    return errcnt
+
+# random merges and splits through fusion.FusionTracker, against a full dram_traffic and the tflite_ut checks.
+# Merges append a later group, half of the time one consuming the last op of the earlier group.
+def check_tracker(mp, rng, steps):
+    from tflite_ut import basic
+    errcnt = 0
+    tracker = fusion.FusionTracker(mp)
+    for i in range(steps):
+        orgs = sorted(mp.fus_grps)
+        multi = [x for x in orgs if len(mp.fus_grps[x]) > 1]
+        if len(orgs) > 1 and (not multi or rng.random() < 0.5):
+            a, b = sorted(rng.sample(orgs, 2))
+            last = mp.fus_grps[a][-1]
+            succ = [x for x in mp.op_succ[mp.op_succ_ptr[last]:mp.op_succ_ptr[last+1]].tolist() if x in mp.fus_grps and x > a]
+            if succ and rng.random() < 0.5:
+                b = rng.choice(succ)
+            tracker.merge(a, b)
+            step = 'merge %d %d' %(a, b)
+        elif multi:
+            org_idx = rng.choice(multi)
+            pos = rng.randrange(1, len(mp.fus_grps[org_idx]))
+            tracker.split(org_idx, pos)
+            step = 'split %d %d' %(org_idx, pos)
+        else:
+            break
+        traffic = fusion.dram_traffic(mp)
+        op_dram = traffic.rd_fus + traffic.wr_fus
+        key = mp.group_keys()
+        if (tracker.total_fus() != traffic.total_fus() or (tracker.traffic.rd_fus != traffic.rd_fus).any() or
+                (tracker.traffic.wr_fus != traffic.wr_fus).any() or
+                any([tracker.grp_dram[x] != int(op_dram[key == x].sum()) for x in mp.fus_grps])):
+            print('ERROR: %s, tracked dram traffic %d, recomputed %d' %(step, tracker.total_fus(), traffic.total_fus()))
+            errcnt += 1
+        # ut_dependency runs a group at its 1st op, but marks its other ops done as it passes them:
+        # it only sees every out-of-order edge while no group holds an op before its 1st one
+        unlinked = basic.ut_next_successor(mp)
+        order = basic.ut_dependency(mp)
+        exact = all([min(grp) == org_idx for org_idx, grp in mp.fus_grps.items()])
+        fresh = fusion.FusionTracker(mp)
+        if (tracker.num_unlinked != unlinked or tracker.num_order < order or (exact and tracker.num_order != order) or
+                (tracker.num_unlinked, tracker.num_order) != (fresh.num_unlinked, fresh.num_order)):
+            print('ERROR: %s, tracked %d unlinked / %d out of order, tflite_ut %d / %d' %(
+                step, tracker.num_unlinked, tracker.num_order, unlinked, order))
+            errcnt += 1
+    return errcnt
+
+# analyze_model on gen_while models (main, cond, body): the pooled run must agree with -j 1 per subgraph
+def check_pool(tg, sizes, sram_size, jobs=3):
+    errcnt = 0
+    keys = ['fus_grps', 'dram', 'dram_fus']
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for num_ops in sizes:
+            model = os.path.join(tmpdir, 'while%d.tflite' %(num_ops))
+            with open(model, 'wb') as fd:
+                fd.write(tflite_gen.build_model(tflite_gen.gen_while(num_ops)))
+            for policy in fusion.policies:
+                args = argparse.Namespace(model=model, mmap=False, policy=policy, sram=sram_size, jobs=1)
+                serial = [result for _, result in tg.analyze_model(args)]
+                args.jobs = jobs
+                pooled = [result for _, result in tg.analyze_model(args)]
+                if len(pooled) != len(serial):
+                    print('ERROR: %d ops, %s, %d subgraphs pooled, %d with -j 1' %(num_ops, policy, len(pooled), len(serial)))
+                    errcnt += 1
+                    continue
+                for a, b in zip(pooled, serial):
+                    for key in keys:
+                        if a[key] != b[key]:
+                            print('ERROR: %d ops, %s, subgraph %d %s pooled %s, with -j 1 %s' %(num_ops, policy, b['subgraph'], key, a[key], b[key]))
+                            errcnt += 1
+    return errcnt
+
+# random DAGs of up to max_ops ops through every policy, the tflite_ut checks and the DRAM model,
+# each under an sram budget of none, one or two activations or unbounded, then edited by check_tracker;
+# then gen_while models through check_pool
+def stress(tg, num_models, max_ops, seed):
+    import tflite_ut
+    rng = random.Random(seed)
+    errcnt = 0
+    sram_size = fusion.defvals.sram_size
+    try:
+        for i in range(num_models):
+            model_seed = rng.randrange(1 << 30)
+            num_ops = rng.randint(1, max_ops)
+            mp, _ = bench_parse(tg, tflite_gen.build_model([tflite_gen.gen_random(num_ops, model_seed)]))
+            act = int(mp.tensor_bytes[~mp.tensor_const].max())
+            fusion.defvals.sram_size = rng.choice([0, act, 2 * act, sys.maxsize])
+            for policy in fusion.policies:
+                bench_fusion(mp, policy)
+                with contextlib.redirect_stdout(io.StringIO()) as log:
+                    cnt = sum([m.unit_test(mp) for m in tflite_ut.mods])
+                    traffic = fusion.caculate_dram_traffic(mp)
+                    if traffic.total_fus() > traffic.total():
+                        print('ERROR: dram traffic %d with fusion, %d without' %(traffic.total_fus(), traffic.total()))
+                        cnt += 1
+                    if policy == 'fus_dram_dp':
+                        cnt += check_budget(mp)
+                if cnt:
+                    print('FAILED: seed %d, %d ops, %s, sram %d' %(model_seed, num_ops, policy, fusion.defvals.sram_size))
+                    print(log.getvalue(), end='')
+                    errcnt += cnt
+            with contextlib.redirect_stdout(io.StringIO()) as log:
+                cnt = check_tracker(mp, rng, 20)
+            if cnt:
+                print('FAILED: seed %d, %d ops, fusion tracker' %(model_seed, num_ops))
+                print(log.getvalue(), end='')
+                errcnt += cnt
+        with contextlib.redirect_stdout(io.StringIO()) as log:
+            cnt = check_pool(tg, [4, max_ops], sram_size)
+        if cnt:
+            print('FAILED: while models, pooled analysis')
+            print(log.getvalue(), end='')
+            errcnt += cnt
+    finally:
+        fusion.defvals.sram_size = sram_size
+    print('%d random models, %d policies: %s' %(num_models, len(fusion.policies), 'PASS' if errcnt == 0 else 'FAILED: %d' %(errcnt)))
+    return errcnt
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-s', '--sizes', default='1000,10000,100000')
+    parser.add_argument('-p', '--pattern', nargs='+', default=list(tflite_gen.generators), choices=list(tflite_gen.generators))
+    parser.add_argument('--stress', type=int, default=0, help='check N random models instead')
+    parser.add_argument('--max_ops', type=int, default=200, help='ops per random model')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    tg = load_tflite_graph()
+    if args.stress:
+        if stress(tg, args.stress, args.max_ops, args.seed):
+            sys.exit(1)
+        return
+
+    policies = list(fusion.policies)
+    print('%-8s %8s %10s %10s' %('pattern', 'ops', 'parse(s)', 'us/op') + ''.join([' %22s' %(x + '(s)') for x in policies]) + ' %10s' %('dram(s)'))
+    for pattern in args.pattern:
+        for num_ops in map(int, args.sizes.split(',')):
+            buf = tflite_gen.build_model([tflite_gen.generators[pattern](num_ops)])
+            mp, elapsed = bench_parse(tg, buf)
+            msg = '%-8s %8d %10.3f %10.2f' %(pattern, len(mp.ops), elapsed, elapsed * 1e6 / len(mp.ops))
+            for policy in policies:
+                msg += ' %22.3f' %(bench_fusion(mp, policy))
+            mp.reset_fusion()
+            fusion.do_fusion(mp)
+            msg += ' %10.3f' %(bench_dram(mp))
+            print(msg)
+
+    return
+
+if __name__ == '__main__':
+    main()
@@ -1,161 +1,778 @@
 #!/usr/bin/python3
 
+import time
+import_start = time.perf_counter()
+
 import os
 import re
+import csv
+import glob
+import json
+import hashlib
+import mmap
+import contextlib
 import configparser
 import argparse
+import concurrent.futures
+import importlib.util
 import tflite
 import numpy
-import graphviz
-import tflite_ut
 import fusion
+import roofline
+import schedule
+import cache
+import csr
+
+# graphviz and tflite_ut are imported on demand (--graph / --test)
+import_time = time.perf_counter() - import_start
 
 def dim2str(a):
     if isinstance(a, numpy.ndarray):
         return numpy.array2string(a, separator='x')
     return str(a)
 
+def dot_str(s):
+    return '"%s"' %(s.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+
+# 'first-last' op idxs (either side optional, inclusive) or a single op idx
+def op_range(s):
+    first, dash, last = s.partition('-')
+    if not dash:
+        return int(first), int(first)
+    return int(first) if first else 0, int(last) if last else None
+
+def bytes2str(n):
+    for unit in ('B', 'KB', 'MB'):
+        if n < 1024:
+            return '%.1f %s' %(n, unit) if unit != 'B' else '%d B' %(n)
+        n /= 1024.0
+    return '%.1f GB' %(n)
+
 class defvals:
     section = 'tflite-graph'
 
+class Timings:
+    def __init__(self):
+        self.phases = {}
+
+    def add(self, name, elapsed):
+        self.phases[name] = self.phases.get(name, 0.0) + elapsed
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        yield
+        self.add(name, time.perf_counter() - start)
+
+    def __str__(self):
+        return '\n'.join(['%-8s %8.3f s' %(name, elapsed) for name, elapsed in self.phases.items()])
+
+# element size in bits by tflite.TensorType (STRING, RESOURCE, VARIANT: unknown, 0)
+dtype_bits = numpy.zeros(32, dtype=numpy.int64)
+dtype_names = {}
+for name, bits in (('FLOAT32', 32), ('FLOAT16', 16), ('INT32', 32), ('UINT8', 8), ('INT64', 64),
+        ('BOOL', 8), ('INT16', 16), ('COMPLEX64', 64), ('INT8', 8), ('FLOAT64', 64), ('COMPLEX128', 128),
+        ('UINT64', 64), ('UINT32', 32), ('UINT16', 16), ('INT4', 4), ('BFLOAT16', 16)):
+    if hasattr(tflite.TensorType, name):
+        dtype_bits[getattr(tflite.TensorType, name)] = bits
+        dtype_names[getattr(tflite.TensorType, name)] = name.lower()
+
+# call-site ops: builtin options class and its subgraph index fields
+callee_options = {
+    tflite.BuiltinOperator.WHILE: (tflite.WhileOptions, ('CondSubgraphIndex', 'BodySubgraphIndex')),
+    tflite.BuiltinOperator.IF: (tflite.IfOptions, ('ThenSubgraphIndex', 'ElseSubgraphIndex')),
+    tflite.BuiltinOperator.CALL_ONCE: (tflite.CallOnceOptions, ('InitSubgraphIndex',)),
+    tflite.BuiltinOperator.CALL: (tflite.CallOptions, ('Subgraph',)),
+}
+
+# sliding-window ops: builtin options class, filter size from options (pools) or weights [O, H, W, I]
+window_options = {
+    tflite.BuiltinOperator.CONV_2D: tflite.Conv2DOptions,
+    tflite.BuiltinOperator.DEPTHWISE_CONV_2D: tflite.DepthwiseConv2DOptions,
+    tflite.BuiltinOperator.AVERAGE_POOL_2D: tflite.Pool2DOptions,
+    tflite.BuiltinOperator.MAX_POOL_2D: tflite.Pool2DOptions,
+    tflite.BuiltinOperator.L2_POOL_2D: tflite.Pool2DOptions,
+}
+
 class TensorInfo:
-    def __init__(self, idx, tensor):
+    __slots__ = ('mp', 'idx')
+
+    def __init__(self, mp, idx):
+        self.mp = mp
         self.idx = idx
-        self.tensor = tensor
-        self.head = None
-        self.tail = []
 
     def __str__(self):
-        return dim2str(self.tensor.ShapeAsNumpy())
+        return dim2str(self.shape())
+
+    @property
+    def tensor(self):
+        return self.mp.subgraph.Tensors(self.idx)
+
+    @property
+    def head(self):
+        op_idx = self.mp.tensor_head[self.idx]
+        return self.mp.ops[op_idx] if op_idx >= 0 else None
+
+    @property
+    def tail(self):
+        return self.mp.get_ops(self.mp.tensor_tail_ptr, self.mp.tensor_tail, self.idx)
+
+    def shape(self):
+        return self.mp.tensor_shape[self.idx, :self.mp.tensor_rank[self.idx]]
 
     def size(self):
-        size = 1
-        for i in self.tensor.ShapeAsNumpy():
-            size *= i
-        return size
+        return int(self.mp.tensor_size[self.idx])
+
+    def nbytes(self):
+        return int(self.mp.tensor_bytes[self.idx])
 
 class OpInfo:
-    def __init__(self, idx, op_code):
+    __slots__ = ('mp', 'idx')
+
+    def __init__(self, mp, idx):
+        self.mp = mp
         self.idx = idx
-        self.op_code = op_code
-        self.op_name = tflite.opcode2name(self.op_code)
-        self.inputs = None # TensorInfo Refs
-        self.outputs = None # TensorInfo Refs
-        self.pred = []
-        self.succ = []
-        self.fus_grp = [] # refs list (only for 1st op)
-        self.fus_org = None # 1st op ref (only for other ops)
 
     def __str__(self):
         return '%d_%s' %(self.idx, self.op_name)
 
+    @property
+    def op_code(self):
+        return int(self.mp.op_codes[self.idx])
+
+    @property
+    def op_name(self):
+        return tflite.opcode2name(self.op_code)
+
+    @property
+    def inputs(self): # TensorInfo Refs
+        return self.mp.get_tensors(self.mp.op_inputs_ptr, self.mp.op_inputs, self.idx)
+
+    @property
+    def outputs(self): # TensorInfo Refs
+        return self.mp.get_tensors(self.mp.op_outputs_ptr, self.mp.op_outputs, self.idx)
+
+    @property
+    def pred(self):
+        return self.mp.get_ops(self.mp.op_pred_ptr, self.mp.op_pred, self.idx)
+
+    @property
+    def succ(self):
+        return self.mp.get_ops(self.mp.op_succ_ptr, self.mp.op_succ, self.idx)
+
+    @property
+    def fus_grp(self): # refs list (only for 1st op)
+        return [self.mp.ops[idx] for idx in self.mp.fus_grps.get(self.idx, [])]
+
+    @property
+    def fus_org(self): # 1st op ref (only for other ops)
+        org_idx = self.mp.fus_org[self.idx]
+        return self.mp.ops[org_idx] if org_idx >= 0 else None
+
+    @property
+    def callees(self): # subgraph idxs
+        return self.mp.op_callees.get(self.idx, [])
+
+    @property
+    def window(self): # (padding, stride w, h, dilation w, h, filter w, h) or None
+        return self.mp.op_windows.get(self.idx)
+
     def nodename(self):
         return '%d_%s' %(self.idx, self.op_name)
 
     def fus_idxs(self):
-        return [op.idx for op in self.fus_grp]
+        return list(self.mp.fus_grps.get(self.idx, []))
 
 class ModelParser:
-    def __init__(self, args):
+    def __init__(self, args, subgraph_idx=0):
         self.args = args
         self.model = None
+        self.mm = None
+        self.subgraph_idx = subgraph_idx
         self.subgraph = None
-        self.tensors = []
-        self.ops = []
+        self.tensors = [] # TensorInfo views
+        self.ops = [] # OpInfo views
+        # tensor table
+        self.tensor_shape = None # [tensors, max rank], padded with 1
+        self.tensor_rank = None
+        self.tensor_size = None
+        self.tensor_type = None
+        self.tensor_bytes = None
+        self.tensor_qbytes = None # quantization parameters: scale + zero point per channel
+        self.tensor_const = None # weights and other constants
+        self.tensor_prod = None # producer op (-1: none)
+        self.tensor_head = None # producer op of I/O tensors (-1: none)
+        self.tensor_tail_ptr = None # CSR: consumer ops
+        self.tensor_tail = None
+        # op table
+        self.op_codes = None
+        self.op_inputs_ptr = None # CSR: input tensors
+        self.op_inputs = None
+        self.op_outputs_ptr = None # CSR: output tensors
+        self.op_outputs = None
+        self.op_pred_ptr = None # CSR: predecessor ops
+        self.op_pred = None
+        self.op_succ_ptr = None # CSR: successor ops
+        self.op_succ = None
+        self.op_callees = {} # call-site op idx -> subgraph idxs
+        self.op_windows = {} # conv / pool op idx -> window, see OpInfo.window
+        self.op_adj_x = {} # batch matmul op idx -> input 0 is [..., K, M]
+        self.graph_inputs = None
+        self.graph_outputs = None
+        # fusion
+        self.fus_org = None # 1st op idx (-1: none)
+        self.fus_grps = {} # 1st op idx -> op idxs
+
+    state_attrs = (
+        'tensor_shape', 'tensor_rank', 'tensor_size', 'tensor_type',
+        'tensor_bytes', 'tensor_qbytes', 'tensor_const', 'graph_inputs', 'graph_outputs',
+        'tensor_prod', 'tensor_head', 'tensor_tail_ptr', 'tensor_tail',
+        'op_codes', 'op_inputs_ptr', 'op_inputs', 'op_outputs_ptr', 'op_outputs',
+        'op_pred_ptr', 'op_pred', 'op_succ_ptr', 'op_succ', 'op_callees', 'op_windows', 'op_adj_x',
+        'fus_org', 'fus_grps',
+    )
 
     def __str__(self):
         return '\n'.join([op.nodename() for op in self.ops])
 
     def load_model(self):
         with open(self.args.model, 'rb') as fd:
-            self.model = tflite.Model.GetRootAsModel(fd.read(), 0)
+            if self.args.mmap:
+                # zero-copy: weight buffers are only paged in when touched
+                try:
+                    self.mm = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+                    if hasattr(mmap, 'MADV_RANDOM'):
+                        self.mm.madvise(mmap.MADV_RANDOM) # no readahead into weights
+                    return self.load_buffer(memoryview(self.mm))
+                except (ValueError, OSError):
+                    self.mm = None
+            return self.load_buffer(fd.read())
+
+    def load_buffer(self, buf):
+        self.model = tflite.Model.GetRootAsModel(buf, 0)
         return self.model
 
-    def get_successor(self, op_idx):
-        results = []
-        op = self.subgraph.Operators(op_idx)
-        outputs = op.OutputsAsNumpy()
-        for i in range(self.subgraph.OperatorsLength()):
-            op = self.subgraph.Operators(i)
-            for x in op.InputsAsNumpy():
-                if x in outputs:
-                    results.append(i)
-        return results
-
-    def get_inputs(self, op_idx):
-        op = self.subgraph.Operators(op_idx)
-        tensor_idxs = [op.Inputs(i) for i in range(op.InputsLength())]
-        return [self.tensors[i] for i in tensor_idxs]
-
-    def get_outputs(self, op_idx):
-        op = self.subgraph.Operators(op_idx)
-        tensor_idxs = [op.Outputs(i) for i in range(op.OutputsLength())]
-        return [self.tensors[i] for i in tensor_idxs]
+    def get_ops(self, ptr, idxs, i):
+        return [self.ops[x] for x in idxs[ptr[i]:ptr[i+1]].tolist()]
+
+    def get_tensors(self, ptr, idxs, i):
+        return [self.tensors[x] for x in idxs[ptr[i]:ptr[i+1]].tolist()]
 
     def parse_subgraph(self):
-        self.subgraph = self.model.Subgraphs(0)
-        for tensor_idx in range(self.subgraph.TensorsLength()):
+        self.subgraph = self.model.Subgraphs(self.subgraph_idx)
+        num_tensors = self.subgraph.TensorsLength()
+        num_ops = self.subgraph.OperatorsLength()
+
+        # tensor table: shape, size and dtype
+        shapes = []
+        self.tensor_type = numpy.zeros(num_tensors, dtype=numpy.int8)
+        self.tensor_qbytes = numpy.zeros(num_tensors, dtype=numpy.int64)
+        variables = numpy.zeros(num_tensors, dtype=bool)
+        for tensor_idx in range(num_tensors):
             tensor = self.subgraph.Tensors(tensor_idx)
-            self.tensors.append(TensorInfo(tensor_idx, tensor))
-        for op_idx in range(self.subgraph.OperatorsLength()):
+            shapes.append(tensor.ShapeAsNumpy() if tensor.ShapeLength() else numpy.zeros(0, dtype=numpy.int32))
+            self.tensor_type[tensor_idx] = tensor.Type()
+            variables[tensor_idx] = tensor.IsVariable()
+            quant = tensor.Quantization()
+            if quant:
+                self.tensor_qbytes[tensor_idx] = 4 * quant.ScaleLength() + 8 * quant.ZeroPointLength() # float scales, int64 zero points
+        self.tensor_rank = numpy.array([len(x) for x in shapes], dtype=numpy.int32)
+        max_rank = int(self.tensor_rank.max()) if num_tensors else 0
+        self.tensor_shape = numpy.ones((num_tensors, max_rank), dtype=numpy.int32)
+        if shapes:
+            mask = numpy.arange(max_rank) < self.tensor_rank[:, None]
+            self.tensor_shape[mask] = numpy.concatenate(shapes)
+        self.tensor_size = numpy.prod(self.tensor_shape, axis=1, dtype=numpy.int64)
+        self.tensor_bytes = (self.tensor_size * dtype_bits[self.tensor_type] + 7) // 8
+        self.graph_inputs = self.subgraph.InputsAsNumpy().astype(numpy.int32) if self.subgraph.InputsLength() else numpy.zeros(0, dtype=numpy.int32)
+        self.graph_outputs = self.subgraph.OutputsAsNumpy().astype(numpy.int32) if self.subgraph.OutputsLength() else numpy.zeros(0, dtype=numpy.int32)
+
+        # op table: opcode, inputs and outputs
+        builtin_codes = [self.model.OperatorCodes(i).BuiltinCode() for i in range(self.model.OperatorCodesLength())]
+        self.op_codes = numpy.zeros(num_ops, dtype=numpy.int32)
+        inputs = []
+        outputs = []
+        for op_idx in range(num_ops):
             op = self.subgraph.Operators(op_idx)
-            op_info = OpInfo(op_idx, self.model.OperatorCodes(op.OpcodeIndex()).BuiltinCode())
-            op_info.inputs = self.get_inputs(op_idx)
-            op_info.outputs = self.get_outputs(op_idx)
-            self.ops.append(op_info)
-        # updatae OpInfo: predecessor and successor
-        for op in self.ops:
-            for succ_idx in self.get_successor(op.idx):
-                succ_op = self.ops[succ_idx]
-                op.succ.append(succ_op)
-                succ_op.pred.append(op)
-                # update TensorInfo
-                for output in op.outputs:
-                    if output in succ_op.inputs:
-                        output.head = op
-                        output.tail.append(succ_op)
+            self.op_codes[op_idx] = builtin_codes[op.OpcodeIndex()]
+            x = op.InputsAsNumpy() if op.InputsLength() else numpy.zeros(0, dtype=numpy.int32)
+            inputs.append(x[x >= 0]) # -1: optional input
+            outputs.append(op.OutputsAsNumpy() if op.OutputsLength() else numpy.zeros(0, dtype=numpy.int32))
+            if self.op_codes[op_idx] in callee_options:
+                self.op_callees[op_idx] = self.get_callees(op, self.op_codes[op_idx])
+            if self.op_codes[op_idx] in window_options:
+                self.op_windows[op_idx] = self.get_window(op, self.op_codes[op_idx], shapes[x[1]] if len(x) > 1 else None)
+            if self.op_codes[op_idx] == tflite.BuiltinOperator.BATCH_MATMUL:
+                self.op_adj_x[op_idx] = self.get_adj_x(op)
+        self.op_inputs_ptr, self.op_inputs = self.concat(inputs)
+        self.op_outputs_ptr, self.op_outputs = self.concat(outputs)
+
+        self.link_ops()
+        # constants: neither produced by an op nor fed as graph input or variable
+        self.tensor_const = self.tensor_prod < 0
+        self.tensor_const[self.graph_inputs] = False
+        self.tensor_const[variables] = False
+        self.reset_fusion()
+        self.make_views()
         return self.ops
 
+    def make_views(self):
+        self.tensors = [TensorInfo(self, i) for i in range(len(self.tensor_size))]
+        self.ops = [OpInfo(self, i) for i in range(len(self.op_codes))]
+
+    # parsed graph and fusion groups, without any reference to the flatbuffer
+    def get_state(self):
+        return {k: getattr(self, k) for k in self.state_attrs}
+
+    def set_state(self, state):
+        for k in self.state_attrs:
+            setattr(self, k, state[k])
+        self.make_views()
+
+    def get_callees(self, op, op_code):
+        options_cls, fields = callee_options[op_code]
+        table = op.BuiltinOptions()
+        if table is None:
+            return []
+        options = options_cls()
+        options.Init(table.Bytes, table.Pos)
+        return [getattr(options, field)() for field in fields]
+
+    def get_adj_x(self, op):
+        table = op.BuiltinOptions()
+        if table is None:
+            return False
+        options = tflite.BatchMatMulOptions()
+        options.Init(table.Bytes, table.Pos)
+        return bool(options.AdjX())
+
+    def get_window(self, op, op_code, flt_shape):
+        options = window_options[op_code]()
+        table = op.BuiltinOptions()
+        if table is None:
+            return None
+        options.Init(table.Bytes, table.Pos)
+        padding = 'SAME' if options.Padding() == tflite.Padding.SAME else 'VALID'
+        if isinstance(options, tflite.Pool2DOptions):
+            dilation = (1, 1)
+            flt = (options.FilterWidth(), options.FilterHeight())
+        elif flt_shape is not None and len(flt_shape) == 4:
+            dilation = (options.DilationWFactor(), options.DilationHFactor())
+            flt = (int(flt_shape[2]), int(flt_shape[1]))
+        else:
+            return None
+        return (padding, options.StrideW(), options.StrideH()) + dilation + flt
+
+    def subgraph_name(self):
+        for i in range(self.model.SignatureDefsLength()):
+            sig = self.model.SignatureDefs(i)
+            if sig.SubgraphIndex() == self.subgraph_idx:
+                return sig.SignatureKey().decode()
+        name = self.subgraph.Name()
+        return name.decode() if name else str(self.subgraph_idx)
+
+    def concat(self, arrays):
+        ptr = numpy.zeros(len(arrays) + 1, dtype=numpy.int64)
+        ptr[1:] = numpy.cumsum([len(x) for x in arrays])
+        idxs = numpy.concatenate(arrays).astype(numpy.int32) if arrays else numpy.zeros(0, dtype=numpy.int32)
+        return ptr, idxs
+
+    def link_ops(self):
+        num_tensors = len(self.tensor_size)
+        num_ops = len(self.op_codes)
+        # tensor index: producer op and consumer ops (ascending, no duplicates)
+        self.tensor_prod = numpy.full(num_tensors, -1, dtype=numpy.int32)
+        self.tensor_prod[self.op_outputs] = csr.csr_rows(self.op_outputs_ptr)
+        self.tensor_tail_ptr, self.tensor_tail = csr.csr(self.op_inputs, csr.csr_rows(self.op_inputs_ptr), num_tensors, num_ops)
+        self.tensor_head = numpy.where(numpy.diff(self.tensor_tail_ptr) > 0, self.tensor_prod, -1).astype(numpy.int32)
+        # predecessor and successor
+        src = self.tensor_prod[csr.csr_rows(self.tensor_tail_ptr)]
+        mask = src >= 0
+        src, dst = src[mask], self.tensor_tail[mask]
+        self.op_succ_ptr, self.op_succ = csr.csr(src, dst, num_ops, num_ops)
+        self.op_pred_ptr, self.op_pred = csr.csr(dst, src, num_ops, num_ops)
+
+    # fusion group of every op, named by its 1st op; ops outside any group are their own group
+    def group_keys(self):
+        return numpy.where(self.fus_org >= 0, self.fus_org, numpy.arange(len(self.op_codes)))
+
+    def reset_fusion(self):
+        self.fus_org = numpy.full(len(self.op_codes), -1, dtype=numpy.int32)
+        self.fus_grps = {}
+
     def add_fus_idxs(self, idxs):
-        org_idx = idxs[0]
-        org = self.ops[org_idx]
-        for cur_idx in idxs:
-            cur = self.ops[cur_idx]
-            if cur in org.fus_grp:
+        org_idx = int(idxs[0])
+        fus_grp = self.fus_grps.setdefault(org_idx, [])
+        fused = set(fus_grp)
+        for cur_idx in map(int, idxs):
+            if cur_idx in fused:
                 continue
-            org.fus_grp.append(cur) # refs list (only for 1st op)
+            fused.add(cur_idx)
+            fus_grp.append(cur_idx) # (only for 1st op)
             if cur_idx != org_idx:
-                cur.fus_org = org # 1st op ref (only for other ops)
-
-    def plot(self):
-        g = graphviz.Digraph()
-        for op in self.ops:
-            if len(op.fus_grp) > 1:
-                with g.subgraph(name='cluster_'+str(op.idx)) as c:
-                    fus_idxs = op.fus_idxs()
-                    c.attr(color='blue', fontcolor='blue', label=str(fus_idxs))
-                    c.edge_attr['style'] = 'invis'
+                self.fus_org[cur_idx] = org_idx # (only for other ops)
+
+    # label of an op, or of a whole fusion group
+    def node_label(self, op_idxs):
+        descs = [self.ops[op_idxs[0]].nodename()]
+        if len(op_idxs) > 1:
+            descs.append('+ %d ops' %(len(op_idxs) - 1))
+        callees = [x for op_idx in op_idxs for x in self.op_callees.get(op_idx, [])]
+        if callees:
+            descs.append('-> subgraph ' + ', '.join(map(str, callees)))
+        return dot_str('\n'.join(descs))
+
+    # DOT streamed straight to the file: ops in op_range (first, last) only, their neighbors outside it as
+    # dashed stubs; collapse: one node per fusion group, named by its 1st op
+    def plot(self, filename=None, collapse=False, op_range=None):
+        import graphviz
+        filename = filename or 'Digraph.gv'
+        num_ops = len(self.op_codes)
+        first, last = op_range or (0, None)
+        last = num_ops - 1 if last is None else min(last, num_ops - 1)
+        org = self.group_keys().tolist()
+        node = org if collapse else list(range(num_ops))
+        succ_ptr, succ = self.op_succ_ptr.tolist(), self.op_succ.tolist()
+        pred_ptr, pred = self.op_pred_ptr.tolist(), self.op_pred.tolist()
+        out_ptr, out = self.op_outputs_ptr.tolist(), self.op_outputs.tolist()
+        grps = {}
+        for op_idx in range(first, last + 1):
+            grps.setdefault(org[op_idx], []).append(op_idx)
+        shown = set(grps) if collapse else set(range(first, last + 1))
+
+        with open(filename, 'w') as fd:
+            fd.write('digraph {\n')
+            for org_idx, op_idxs in grps.items():
+                fus_idxs = self.fus_grps.get(org_idx, [org_idx])
+                if collapse:
+                    fd.write('\t%d [label=%s%s]\n' %(org_idx, self.node_label(fus_idxs),
+                        ' color=blue fontcolor=blue' if len(fus_idxs) > 1 else ''))
+                    continue
+                cluster = len(fus_idxs) > 1
+                if cluster:
+                    fd.write('\tsubgraph cluster_%d {\n' %(org_idx))
+                    fd.write('\t\tcolor=blue fontcolor=blue label=%s\n' %(dot_str(str(fus_idxs))))
+                    fus_idxs = [x for x in fus_idxs if first <= x <= last]
                     for x in range(len(fus_idxs) - 1):
-                        c.edge(str(fus_idxs[x]), str(fus_idxs[x+1]))
-        for op in self.ops:
-            descs = []
-            descs.append(op.nodename())
-            g.node(str(op.idx), label='\n'.join(descs))
-            for succ in op.succ:
-                descs = []
-                tensor = op.outputs[0]
-                descs.append(str(tensor))
-                g.edge(str(op.idx), str(succ.idx), label='\n'.join(descs))
-
-        # input & output endpoints
-        last = self.ops[-1].idx
-        g.edge('Input', '0', str(self.ops[0].inputs[0]))
-        g.edge(str(last), 'Output', str(self.ops[last].outputs[0]))
+                        fd.write('\t\t%d -> %d [style=invis]\n' %(fus_idxs[x], fus_idxs[x+1]))
+                for op_idx in op_idxs:
+                    fd.write('\t%s%d [label=%s]\n' %('\t' if cluster else '', op_idx, self.node_label([op_idx])))
+                if cluster:
+                    fd.write('\t}\n')
+
+            # edges from, then into the range; labelled by the 1st output of the producer
+            edges = set()
+            stubs = set()
+            def edge(src_idx, dst_idx):
+                src, dst = node[src_idx], node[dst_idx]
+                if src == dst or (src, dst) in edges:
+                    return
+                edges.add((src, dst))
+                stubs.update([x for x in (src, dst) if x not in shown])
+                fd.write('\t%d -> %d [label=%s]\n' %(src, dst, dot_str(str(self.tensors[out[out_ptr[src_idx]]]))))
+            for op_idx in range(first, last + 1):
+                for succ_idx in succ[succ_ptr[op_idx]:succ_ptr[op_idx+1]]:
+                    edge(op_idx, succ_idx)
+            for op_idx in range(first, last + 1):
+                for pred_idx in pred[pred_ptr[op_idx]:pred_ptr[op_idx+1]]:
+                    if not first <= pred_idx <= last:
+                        edge(pred_idx, op_idx)
+            for x in sorted(stubs):
+                fus_idxs = self.fus_grps.get(x, [x]) if collapse else [x]
+                fd.write('\t%d [label=%s style=dashed%s]\n' %(x, self.node_label(fus_idxs),
+                    ' color=blue fontcolor=blue' if len(fus_idxs) > 1 else ''))
+
+            # input & output endpoints
+            for tensor_idx in self.graph_inputs.tolist():
+                tail = self.tensor_tail[self.tensor_tail_ptr[tensor_idx]:self.tensor_tail_ptr[tensor_idx+1]].tolist()
+                for dst in sorted(set([node[x] for x in tail if first <= x <= last])):
+                    fd.write('\tInput -> %d [label=%s]\n' %(dst, dot_str(str(self.tensors[tensor_idx]))))
+            for tensor_idx in self.graph_outputs.tolist():
+                op_idx = int(self.tensor_prod[tensor_idx])
+                if first <= op_idx <= last:
+                    fd.write('\t%d -> Output [label=%s]\n' %(node[op_idx], dot_str(str(self.tensors[tensor_idx]))))
+            fd.write('}\n')
 
         if self.args.render:
-            g.render()
+            graphviz.render('dot', 'pdf', filename)
         else:
-            g.view()
+            graphviz.view(graphviz.render('dot', 'pdf', filename))
+
+def analyze_subgraph(args, subgraph_idx):
+    fusion.defvals.sram_size = args.sram
+    timings = Timings()
+    mp = ModelParser(args, subgraph_idx)
+    with timings.phase('load'):
+        mp.load_model()
+    with timings.phase('parse'):
+        mp.parse_subgraph()
+    with timings.phase('fusion'):
+        fusion.do_fusion(mp, args.policy)
+    with timings.phase('dram'):
+        traffic = fusion.caculate_dram_traffic(mp)
+    result = {
+        'subgraph': subgraph_idx,
+        'name': mp.subgraph_name(),
+        'ops': len(mp.ops),
+        'fus_grps': mp.fus_grps,
+        'callees': mp.op_callees,
+        'dram': traffic.total(),
+        'dram_fus': traffic.total_fus(),
+        'dram_rd': int(traffic.rd_fus.sum()),
+        'dram_wr': int(traffic.wr_fus.sum()),
+        'dram_wt': int(traffic.wt.sum()),
+        'timings': timings.phases, # of the run that filled the cache on a hit
+        'cached': False,
+        'state': mp.get_state(),
+    }
+    return mp, result
+
+def analyze_subgraph_job(args, subgraph_idx):
+    return analyze_subgraph(args, subgraph_idx)[1]
+
+# Fusion and DRAM accounting of every subgraph, across a process pool
+def analyze_model(args):
+    num_subgraphs = ModelParser(args).load_model().SubgraphsLength()
+    if args.jobs == 1 or num_subgraphs == 1:
+        return [analyze_subgraph(args, i) for i in range(num_subgraphs)]
+    with concurrent.futures.ProcessPoolExecutor(min(args.jobs, num_subgraphs)) as pool:
+        results = list(pool.map(analyze_subgraph_job, [args] * num_subgraphs, range(num_subgraphs)))
+    return [(restore_subgraph(args, result), result) for result in results]
+
+def restore_subgraph(args, result):
+    mp = ModelParser(args, result['subgraph'])
+    mp.set_state(result['state'])
+    return mp
+
+def tool_version():
+    h = hashlib.blake2b(digest_size=20)
+    for path in (__file__, fusion.__file__, csr.__file__):
+        with open(path, 'rb') as fd:
+            h.update(fd.read())
+    return h.hexdigest()
+
+# analyze_model() through the on-disk cache, keyed by model content, fusion policy and tool version
+def cached_analyze_model(args):
+    if not args.cache:
+        return analyze_model(args)
+    c = cache.Cache(args.cache_dir, args.cache_size)
+    key = cache.make_key(c.model_hash(args.model), args.policy, args.sram, tool_version())
+    results = c.get(key)
+    if results is not None:
+        for result in results:
+            result['cached'] = True
+        return [(restore_subgraph(args, result), result) for result in results]
+    analyses = analyze_model(args)
+    c.put(key, [result for _, result in analyses])
+    return analyses
+
+# Every registered fusion policy on the same parsed subgraphs
+def compare_policies(args):
+    fusion.defvals.sram_size = args.sram
+    mps = []
+    for subgraph_idx in range(ModelParser(args).load_model().SubgraphsLength()):
+        mps.append(ModelParser(args, subgraph_idx))
+        mps[-1].load_model()
+        mps[-1].parse_subgraph()
+    print('%-24s %8s %12s %12s' %('policy', 'groups', 'dram usage', 'fusion(s)'))
+    for name, policy in fusion.policies.items():
+        groups = 0
+        elapsed = 0.0
+        dram = 0
+        dram_fus = 0
+        for mp in mps:
+            mp.reset_fusion()
+            start = time.perf_counter()
+            policy(mp)
+            elapsed += time.perf_counter() - start
+            traffic = fusion.caculate_dram_traffic(mp)
+            groups += len(mp.fus_grps)
+            dram += traffic.total()
+            dram_fus += traffic.total_fus()
+        print('{:<24s} {:8d} {:>12.1%} {:12.3f}'.format(name, groups, float(dram_fus) / dram if dram else 0.0, elapsed))
+
+def find_models(pattern):
+    if os.path.isdir(pattern):
+        pattern = os.path.join(pattern, '**', '*.tflite')
+    return sorted(glob.glob(pattern, recursive=True))
+
+def analyze_model_job(args, model):
+    args = argparse.Namespace(**vars(args))
+    args.model = model
+    args.jobs = 1 # no nested pools
+    args.test = args.graph = False
+    row = {'model': model, 'subgraphs': 0, 'ops': 0, 'groups': 0, 'dram_usage': 0.0, 'dram_bytes': 0, 'dram_fus_bytes': 0,
+        'load_time': 0.0, 'parse_time': 0.0, 'fusion_time': 0.0, 'cached': False, 'error': ''}
+    try:
+        results = [result for _, result in cached_analyze_model(args)]
+    except Exception as e:
+        row['error'] = '%s: %s' %(type(e).__name__, e)
+        return row
+    dram = sum(result['dram'] for result in results)
+    dram_fus = sum(result['dram_fus'] for result in results)
+    row['subgraphs'] = len(results)
+    row['ops'] = sum(result['ops'] for result in results)
+    row['groups'] = sum(len(result['fus_grps']) for result in results)
+    row['dram_usage'] = float(dram_fus) / dram if dram else 0.0
+    row['dram_bytes'] = dram
+    row['dram_fus_bytes'] = dram_fus
+    for phase in ('load', 'parse', 'fusion'):
+        row[phase + '_time'] = sum(result['timings'].get(phase, 0.0) for result in results)
+    row['cached'] = all(result['cached'] for result in results)
+    return row
+
+# One consolidated report (.csv or .json) for every model matched by args.batch
+def do_batch(args):
+    models = find_models(args.batch)
+    with concurrent.futures.ProcessPoolExecutor(args.jobs) as pool:
+        rows = []
+        for row in pool.map(analyze_model_job, [args] * len(models), models):
+            if row['error']:
+                print('%s: %s' %(row['model'], row['error']))
+            else:
+                print('{}: {} ops, {} groups, dram usage {:.0%}'.format(row['model'], row['ops'], row['groups'], row['dram_usage']))
+            rows.append(row)
+    write_report(args.report, rows)
+    print('%d models -> %s' %(len(rows), args.report))
+
+# JSON if filename ends with .json, CSV otherwise (list values space-separated)
+def write_report(filename, rows):
+    with open(filename, 'w', newline='') as fd:
+        if filename.endswith('.json'):
+            json.dump(rows, fd, indent=2)
+            return
+        writer = csv.DictWriter(fd, fieldnames=list(rows[0]) if rows else [])
+        writer.writeheader()
+        for row in rows:
+            writer.writerow({k: ' '.join(map(str, v)) if isinstance(v, list) else v for k, v in row.items()})
+
+def dram_report(args, analyses):
+    rows = []
+    for mp, result in analyses:
+        traffic = fusion.caculate_dram_traffic(mp, args.verbose)
+        for record in traffic.records(mp):
+            rows.append(dict(subgraph=result['subgraph'], **record))
+    if args.dram_report:
+        write_report(args.dram_report, rows)
+
+# Estimated latency of every fusion group against peak compute and DRAM bandwidth
+def roofline_report(args, analyses):
+    rows = []
+    latency = 0.0
+    latency_nofus = 0.0
+    for mp, result in analyses:
+        rl = roofline.Roofline(mp, fusion.dram_traffic(mp), args.peak_gmacs, args.bandwidth)
+        records = rl.records(mp)
+        for record in records:
+            if args.verbose:
+                print('{group}: {ops} ops, {macs} MACs, {dram_bytes} bytes, {latency_us:.1f} us, {bound}-bound'.format(**record))
+            rows.append(dict(subgraph=result['subgraph'], **record))
+        print('subgraph {} roofline: {} groups, {} compute-bound, {} bandwidth-bound, {:.3f} ms'.format(
+            result['subgraph'], len(records), rl.num_compute_bound(), len(records) - rl.num_compute_bound(), rl.latency() * 1e3))
+        latency += rl.latency()
+        latency_nofus += rl.latency_nofus()
+    print('latency {:.3f} ms (without fusion {:.3f} ms) at {:g} GMAC/s, {:g} GB/s'.format(
+        latency * 1e3, latency_nofus * 1e3, args.peak_gmacs, args.bandwidth))
+    if args.roofline_report:
+        write_report(args.roofline_report, rows)
+
+# Execution order of fusion groups and arena offsets of the activations they exchange
+def schedule_report(args, analyses):
+    rows = []
+    for mp, result in analyses:
+        if not mp.ops:
+            continue
+        sched = schedule.Schedule(mp)
+        natural = schedule.Schedule(mp, natural=True)
+        if args.verbose:
+            for step, grp_idx in enumerate(sched.order):
+                print('step {}: {} ({} live)'.format(step, mp.ops[sched.gg.grp_org[grp_idx]], bytes2str(sched.live[step])))
+        print('subgraph {} schedule: {} groups, peak live {} (model order {}), arena {}, {} sram {}'.format(
+            result['subgraph'], len(sched.order), bytes2str(sched.peak_live()), bytes2str(natural.peak_live()),
+            bytes2str(sched.arena), 'fits' if sched.arena <= args.sram else 'exceeds', bytes2str(args.sram)))
+        for record in sched.records(mp):
+            rows.append(dict(subgraph=result['subgraph'], **record))
+    if args.arena_report:
+        write_report(args.arena_report, rows)
+
+def load_tile_fusion():
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tile-fusion.py')
+    spec = importlib.util.spec_from_file_location('tile_fusion', path)
+    mod = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(mod)
+    return mod
+
+# tile-fusion.py layer descriptor of a conv / pool op, NHWC tensors
+def layer_desc(op):
+    padding, sx, sy, dx, dy, fw, fh = op.window
+    in_shape = op.inputs[0].shape()
+    out_shape = op.outputs[0].shape()
+    if op.op_code == tflite.BuiltinOperator.CONV_2D: # filter [O, H, W, I / groups]
+        groups = max(in_shape[3] // op.inputs[1].shape()[3], 1)
+    else: # depthwise, pooling
+        groups = in_shape[3]
+    return 'in={}x{}x{},out={}x{}x{},flt={}x{},stride={}x{},dilation={}x{},pad_type={},groups={},dtype={},batch={}'.format(
+        in_shape[2], in_shape[1], in_shape[3], out_shape[2], out_shape[1], out_shape[3], fw, fh, sx, sy, dx, dy, padding,
+        groups, dtype_names.get(op.mp.tensor_type[op.inputs[0].idx], 'int8'), in_shape[0])
+
+# Layer descriptors of the conv / pool chain leading a fusion group, possibly through ops keeping
+# the spatial size (activations, adds, ...), and why the chain stops before the group ends
+def group_layers(mp, org_idx):
+    descs = []
+    cur = None # activation tensor flowing down the chain
+    for op in mp.ops[org_idx].fus_grp:
+        if op.idx != org_idx and mp.fus_org[op.idx] != org_idx:
+            continue # owned by another group
+        acts = [t.idx for t in op.inputs if not mp.tensor_const[t.idx]]
+        if len(op.outputs) != 1 or op.outputs[0].shape().size != 4:
+            return descs, '{} is not 4D'.format(op)
+        if op.window:
+            if cur is not None and acts[:1] != [cur]:
+                return descs, '{} branches off the chain'.format(op)
+            descs.append(layer_desc(op))
+        elif cur is not None and cur not in acts:
+            return descs, '{} branches off the chain'.format(op)
+        elif cur is not None and not numpy.array_equal(mp.tensors[cur].shape()[1:3], op.outputs[0].shape()[1:3]):
+            return descs, '{} changes the spatial size'.format(op)
+        cur = op.outputs[0].idx
+    return descs, None if descs else 'no conv / pool'
+
+# tile-fusion.py on every fusion group, with the last output split into tile_fusion (WxH) tiles
+def tile_fusion_report(args, analyses):
+    tf = load_tile_fusion()
+    tile_w, tile_h = map(int, args.tile_fusion.split('x'))
+    tiled = 0
+    skipped = 0
+    for mp, result in analyses:
+        for org_idx in sorted(mp.fus_grps):
+            descs, reason = group_layers(mp, org_idx)
+            if not descs:
+                skipped += 1
+                if args.verbose:
+                    print('subgraph {} group {}: skipped, {}'.format(result['subgraph'], mp.ops[org_idx], reason))
+                continue
+            layers = []
+            try:
+                for desc in descs:
+                    layers.append(tf.Layer())
+                    layers[-1].parse_desc(desc)
+            except ValueError as e:
+                skipped += 1
+                if args.verbose:
+                    print('subgraph {} group {}: skipped, {}'.format(result['subgraph'], mp.ops[org_idx], e))
+                continue
+            if args.verbose:
+                print('-' * 80)
+                for idx, desc in enumerate(descs):
+                    print('{} layer {}: {}'.format(mp.ops[org_idx], idx, desc))
+                tf.do_tile_fusion(layers, tile_w, tile_h)
+            tiles_by_layer = tf.do_tile_fusion_np(layers, tile_w, tile_h)
+            cost = tf.TileCost(tile_w, tile_h, layers, tiles_by_layer)
+            print('subgraph {} group {}: {} layers, {} tiles, out {}x{}, buffer {}, recompute {:.1%}{}'.format(
+                result['subgraph'], mp.ops[org_idx], len(layers), len(tiles_by_layer[-1]), layers[-1].out_w, layers[-1].out_h,
+                bytes2str(cost.buffer), cost.recompute, ' (stops: {})'.format(reason) if reason else ''))
+            tiled += 1
+    print('tile fusion: {} groups tiled, {} skipped'.format(tiled, skipped))
 
 class LoadConfig(argparse.Action):
     def __call__(self, parser, namespace, values, option_string=None):
@@ -163,8 +780,11 @@ class LoadConfig(argparse.Action):
         cfg.read(values)
         section = cfg[defvals.section]
         for k in section:
-            if isinstance(getattr(namespace, k), int):
-                setattr(namespace, k, int(section[k]))
+            default = getattr(namespace, k, None)
+            if isinstance(default, bool):
+                setattr(namespace, k, str2bool(section[k]))
+            elif isinstance(default, (int, float)):
+                setattr(namespace, k, type(default)(section[k]))
             else:
                 setattr(namespace, k, section[k])
 
@@ -181,24 +801,100 @@ def str2bool(v):
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument('-c', '--config', action=LoadConfig)
-    parser.add_argument('-m', '--model', required=True)
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument('-m', '--model')
+    group.add_argument('-b', '--batch', help='model directory or glob')
     parser.add_argument('-g', '--graph', type=str2bool, nargs='?', const=True, default=False)
     parser.add_argument('-r', '--render', type=str2bool, nargs='?', const=True, default=False)
+    parser.add_argument('--collapse', type=str2bool, nargs='?', const=True, default=False, help='one graph node per fusion group')
+    parser.add_argument('--ops', metavar='FIRST-LAST', help='graph only these op idxs, e.g. 100-300')
     parser.add_argument('-t', '--test', type=str2bool, nargs='?', const=True, default=False)
+    parser.add_argument('--mmap', type=str2bool, nargs='?', const=True, default=True)
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count())
+    parser.add_argument('-o', '--report', default='report.csv')
+    parser.add_argument('--cache', type=str2bool, nargs='?', const=True, default=True)
+    parser.add_argument('--cache_dir', default=cache.defvals.path)
+    parser.add_argument('--cache_size', type=int, default=cache.defvals.size, help='MB')
+    parser.add_argument('--timings', type=str2bool, nargs='?', const=True, default=False)
+    parser.add_argument('-p', '--policy', default=fusion.defvals.policy, choices=list(fusion.policies))
+    parser.add_argument('--compare_policies', type=str2bool, nargs='?', const=True, default=False)
+    parser.add_argument('-v', '--verbose', type=str2bool, nargs='?', const=True, default=False, help='print per-op dram tensors')
+    parser.add_argument('--dram_report', help='per-op dram traffic, .json or .csv')
+    parser.add_argument('--sram', type=int, default=fusion.defvals.sram_size, help='on-chip capacity for fus_dram_dp and the arena, bytes')
+    parser.add_argument('--roofline', type=str2bool, nargs='?', const=True, default=False, help='estimate latency per fusion group')
+    parser.add_argument('--roofline_report', help='per-group latency, .json or .csv')
+    parser.add_argument('--peak_gmacs', type=float, default=roofline.defvals.peak_gmacs, help='GMAC/s')
+    parser.add_argument('--bandwidth', type=float, default=roofline.defvals.bandwidth, help='DRAM GB/s')
+    parser.add_argument('--schedule', type=str2bool, nargs='?', const=True, default=False, help='order groups for peak memory, plan the arena')
+    parser.add_argument('--arena_report', help='arena offset per tensor, .json or .csv')
+    parser.add_argument('--tile_fusion', metavar='WxH', help='run tile-fusion.py on every conv / pool fusion group')
     args = parser.parse_args()
+    if args.policy not in fusion.policies: # -c skips choices
+        parser.error("policy '%s' not in %s" %(args.policy, ', '.join(fusion.policies)))
+
+    if args.batch:
+        do_batch(args)
+        return
+
+    if args.compare_policies:
+        compare_policies(args)
+        return
 
-    mp = ModelParser(args)
-    mp.load_model()
-    mp.parse_subgraph()
+    timings = Timings()
+    timings.add('import', import_time)
+    with timings.phase('analyze'):
+        analyses = cached_analyze_model(args)
+    num_subgraphs = len(analyses)
+    for mp, result in analyses:
+        if result['cached']:
+            continue # nothing was re-analysed
+        for phase, elapsed in result['timings'].items():
+            timings.add(phase, elapsed)
 
-    fusion.do_fusion(mp)
-    print('dram usage {:.0%}'.format(fusion.caculate_dram_usage(mp)))
+    report_start = time.perf_counter()
+    dram = 0
+    dram_fus = 0
+    dram_parts = [0, 0, 0]
+    if args.verbose or args.dram_report:
+        dram_report(args, analyses)
+    for mp, result in analyses:
+        if num_subgraphs > 1:
+            print('subgraph {} ({}): {} ops, {} groups, dram usage {:.0%}'.format(
+                result['subgraph'], result['name'], result['ops'], len(result['fus_grps']),
+                float(result['dram_fus']) / result['dram'] if result['dram'] else 0.0))
+            for op_idx, callees in result['callees'].items():
+                print('\top {} -> subgraph {}'.format(op_idx, ', '.join(map(str, callees))))
+        dram += result['dram']
+        dram_fus += result['dram_fus']
+        for i, k in enumerate(('dram_rd', 'dram_wr', 'dram_wt')):
+            dram_parts[i] += result[k]
+    print('dram usage {:.0%}'.format(float(dram_fus) / dram if dram else 0.0))
+    print('dram traffic {} -> {} (rd {}, wr {}, weights {})'.format(
+        bytes2str(dram), bytes2str(dram_fus), *map(bytes2str, dram_parts)))
+    if args.roofline or args.roofline_report:
+        roofline_report(args, analyses)
+    if args.schedule or args.arena_report:
+        schedule_report(args, analyses)
+    if args.tile_fusion:
+        tile_fusion_report(args, analyses)
+    timings.add('report', time.perf_counter() - report_start)
 
     if args.test:
-        tflite_ut.unit_test(mp)
+        import tflite_ut
+    for mp, result in analyses:
+        if not mp.ops:
+            continue
+        if args.test:
+            with timings.phase('test'):
+                tflite_ut.unit_test(mp)
+        if args.graph:
+            with timings.phase('graph'):
+                mp.plot('subgraph%d.gv' %(mp.subgraph_idx) if num_subgraphs > 1 else None,
+                    args.collapse, op_range(args.ops) if args.ops else None)
 
-    if args.graph:
-        mp.plot()
+    if args.timings:
+        print('-' * 80)
+        print(timings)
 
     return
 
@@ -0,0 +1,240 @@
+#!/usr/bin/python3
+
+import numpy
+import flatbuffers
+import tflite
+
+class Graph:
+    def __init__(self, name=None):
+        self.name = name
+        self.tensors = [] # (shape, type, data)
+        self.ops = [] # (opcode, inputs, outputs, options)
+        self.inputs = []
+        self.outputs = []
+
+    def tensor(self, shape, type=tflite.TensorType.INT8, data=None):
+        self.tensors.append((shape, type, data))
+        return len(self.tensors) - 1
+
+    def op(self, opcode, inputs, outputs, options=None):
+        self.ops.append((opcode, inputs, outputs, options))
+        return len(self.ops) - 1
+
+def int32_vector(builder, vals):
+    return builder.CreateNumpyVector(numpy.array(vals, dtype=numpy.int32))
+
+def offset_vector(builder, start, offsets):
+    start(builder, len(offsets))
+    for x in reversed(offsets):
+        builder.PrependUOffsetTRelative(x)
+    return builder.EndVector()
+
+def build_buffer(builder, data):
+    data_ofs = builder.CreateNumpyVector(numpy.frombuffer(data, dtype=numpy.uint8)) if data else None
+    tflite.BufferStart(builder)
+    if data_ofs is not None:
+        tflite.BufferAddData(builder, data_ofs)
+    return tflite.BufferEnd(builder)
+
+def build_tensor(builder, shape, type, buffer_idx):
+    shape_ofs = int32_vector(builder, shape)
+    tflite.TensorStart(builder)
+    tflite.TensorAddShape(builder, shape_ofs)
+    tflite.TensorAddType(builder, type)
+    tflite.TensorAddBuffer(builder, buffer_idx)
+    return tflite.TensorEnd(builder)
+
+# e.g. options('WhileOptions', CondSubgraphIndex=1, BodySubgraphIndex=2)
+def options(name, **fields):
+    def build(builder):
+        getattr(tflite, name + 'Start')(builder)
+        for k, v in fields.items():
+            getattr(tflite, name + 'Add' + k)(builder, v)
+        return getattr(tflite.BuiltinOptions, name), getattr(tflite, name + 'End')(builder)
+    return build
+
+def conv_options(stride=1, padding=tflite.Padding.SAME):
+    return options('Conv2DOptions', Padding=padding, StrideW=stride, StrideH=stride)
+
+def build_op(builder, opcode_idx, inputs, outputs, options):
+    inputs_ofs = int32_vector(builder, inputs)
+    outputs_ofs = int32_vector(builder, outputs)
+    options_type, options_ofs = options(builder) if options else (None, None)
+    tflite.OperatorStart(builder)
+    tflite.OperatorAddOpcodeIndex(builder, opcode_idx)
+    tflite.OperatorAddInputs(builder, inputs_ofs)
+    tflite.OperatorAddOutputs(builder, outputs_ofs)
+    if options:
+        tflite.OperatorAddBuiltinOptionsType(builder, options_type)
+        tflite.OperatorAddBuiltinOptions(builder, options_ofs)
+    return tflite.OperatorEnd(builder)
+
+def build_opcode(builder, opcode):
+    tflite.OperatorCodeStart(builder)
+    tflite.OperatorCodeAddDeprecatedBuiltinCode(builder, min(opcode, tflite.BuiltinOperator.PLACEHOLDER_FOR_GREATER_OP_CODES))
+    tflite.OperatorCodeAddBuiltinCode(builder, opcode)
+    tflite.OperatorCodeAddVersion(builder, 1)
+    return tflite.OperatorCodeEnd(builder)
+
+def build_model(graphs):
+    builder = flatbuffers.Builder(1024)
+    buffers = [build_buffer(builder, None)] # buffer 0 is always empty
+    opcodes = []
+    subgraphs = []
+    # buffers first, so that weights end up at the tail of the file as in converted models
+    buffer_idxs = []
+    for graph in graphs:
+        buffer_idxs.append([])
+        for shape, type, data in graph.tensors:
+            if data:
+                buffers.append(build_buffer(builder, data))
+            buffer_idxs[-1].append(len(buffers) - 1 if data else 0)
+    for graph_idx, graph in enumerate(graphs):
+        tensors = []
+        for (shape, type, data), buffer_idx in zip(graph.tensors, buffer_idxs[graph_idx]):
+            tensors.append(build_tensor(builder, shape, type, buffer_idx))
+        ops = []
+        for opcode, inputs, outputs, options in graph.ops:
+            if opcode not in opcodes:
+                opcodes.append(opcode)
+            ops.append(build_op(builder, opcodes.index(opcode), inputs, outputs, options))
+        tensors_ofs = offset_vector(builder, tflite.SubGraphStartTensorsVector, tensors)
+        ops_ofs = offset_vector(builder, tflite.SubGraphStartOperatorsVector, ops)
+        inputs_ofs = int32_vector(builder, graph.inputs)
+        outputs_ofs = int32_vector(builder, graph.outputs)
+        name_ofs = builder.CreateString(graph.name) if graph.name else None
+        tflite.SubGraphStart(builder)
+        tflite.SubGraphAddTensors(builder, tensors_ofs)
+        tflite.SubGraphAddOperators(builder, ops_ofs)
+        tflite.SubGraphAddInputs(builder, inputs_ofs)
+        tflite.SubGraphAddOutputs(builder, outputs_ofs)
+        if name_ofs is not None:
+            tflite.SubGraphAddName(builder, name_ofs)
+        subgraphs.append(tflite.SubGraphEnd(builder))
+    opcodes_ofs = offset_vector(builder, tflite.ModelStartOperatorCodesVector,
+        [build_opcode(builder, opcode) for opcode in opcodes])
+    subgraphs_ofs = offset_vector(builder, tflite.ModelStartSubgraphsVector, subgraphs)
+    buffers_ofs = offset_vector(builder, tflite.ModelStartBuffersVector, buffers)
+    tflite.ModelStart(builder)
+    tflite.ModelAddVersion(builder, 3)
+    tflite.ModelAddOperatorCodes(builder, opcodes_ofs)
+    tflite.ModelAddSubgraphs(builder, subgraphs_ofs)
+    tflite.ModelAddBuffers(builder, buffers_ofs)
+    builder.Finish(tflite.ModelEnd(builder), file_identifier=b'TFL3')
+    return builder.Output()
+
+# conv -> relu -> conv -> relu ...
+def gen_chain(num_ops, shape=(1, 56, 56, 32)):
+    g = Graph()
+    cur = g.tensor(shape)
+    g.inputs.append(cur)
+    for i in range(num_ops):
+        out = g.tensor(shape)
+        if i % 2:
+            g.op(tflite.BuiltinOperator.RELU, [cur], [out])
+        else:
+            flt = g.tensor((shape[3], 3, 3, shape[3]))
+            g.op(tflite.BuiltinOperator.CONV_2D, [cur, flt], [out], conv_options())
+        cur = out
+    g.outputs.append(cur)
+    return g
+
+# stem relu feeding `width` parallel convs joined by a concatenation, repeated
+def gen_branch(num_ops, width=8, shape=(1, 28, 28, 16)):
+    g = Graph()
+    cur = g.tensor(shape)
+    g.inputs.append(cur)
+    while len(g.ops) + width + 2 <= num_ops:
+        stem = g.tensor(shape)
+        g.op(tflite.BuiltinOperator.RELU, [cur], [stem])
+        outs = []
+        for i in range(width):
+            outs.append(g.tensor(shape[:3] + (shape[3] // width,)))
+            flt = g.tensor((shape[3] // width, 1, 1, shape[3]))
+            g.op(tflite.BuiltinOperator.CONV_2D, [stem, flt], [outs[-1]], conv_options())
+        cur = g.tensor(shape)
+        g.op(tflite.BuiltinOperator.CONCATENATION, outs, [cur])
+    while len(g.ops) < num_ops:
+        out = g.tensor(shape)
+        g.op(tflite.BuiltinOperator.RELU, [cur], [out])
+        cur = out
+    g.outputs.append(cur)
+    return g
+
+# random DAG of blocks on one activation shape: conv -> relu chains, diamonds joined by an add,
+# fan-outs of 1x1 convs joined by a concatenation, residual blocks and adds of an older activation.
+# Now and then an activation is also a graph output.
+def gen_random(num_ops, seed=0, shape=(1, 14, 14, 16)):
+    rng = numpy.random.default_rng(seed)
+    g = Graph()
+    cur = g.tensor(shape)
+    g.inputs.append(cur)
+    acts = [cur]
+
+    def conv(x, channels=shape[3], flt=3):
+        out = g.tensor(shape[:3] + (channels,))
+        g.op(tflite.BuiltinOperator.CONV_2D, [x, g.tensor((channels, flt, flt, shape[3]))], [out], conv_options())
+        return out
+
+    def unary(opcode, x):
+        out = g.tensor(shape)
+        g.op(opcode, [x], [out])
+        return out
+
+    def add(x, y):
+        out = g.tensor(shape)
+        g.op(tflite.BuiltinOperator.ADD, [x, y], [out])
+        return out
+
+    while True:
+        left = num_ops - len(g.ops)
+        width = int(rng.choice([2, 4, 8, 16]))
+        blocks = [x for x, size in (('chain', 2), ('diamond', 3), ('fanout', width + 1), ('residual', 4), ('skip', 1)) if size <= left]
+        if not blocks:
+            break
+        block = rng.choice(blocks)
+        if block == 'chain':
+            cur = unary(tflite.BuiltinOperator.RELU, conv(cur))
+        elif block == 'diamond':
+            cur = add(conv(cur), conv(cur, flt=1))
+        elif block == 'fanout':
+            outs = [conv(cur, shape[3] // width, 1) for i in range(width)]
+            cur = g.tensor(shape)
+            g.op(tflite.BuiltinOperator.CONCATENATION, outs, [cur])
+        elif block == 'residual':
+            cur = add(conv(unary(tflite.BuiltinOperator.RELU, conv(cur))), cur)
+        else:
+            cur = add(cur, acts[rng.integers(len(acts))])
+        acts.append(cur)
+        if rng.random() < 0.05:
+            g.outputs.append(cur)
+    if cur not in g.outputs:
+        g.outputs.append(cur)
+    return g
+
+# main: chain -> WHILE(cond, body) -> chain, body: chain
+def gen_while(num_ops, shape=(1, 56, 56, 32)):
+    main = gen_chain(num_ops // 2, shape)
+    main.name = 'main'
+    cond = Graph('cond')
+    cond.inputs.append(cond.tensor(shape))
+    flag = cond.tensor((1,), tflite.TensorType.BOOL)
+    cond.op(tflite.BuiltinOperator.REDUCE_ANY, cond.inputs, [flag])
+    cond.outputs.append(flag)
+    body = gen_chain(num_ops - num_ops // 2, shape)
+    body.name = 'body'
+    cur = main.outputs.pop()
+    loop = main.tensor(shape)
+    main.op(tflite.BuiltinOperator.WHILE, [cur], [loop],
+        options('WhileOptions', CondSubgraphIndex=1, BodySubgraphIndex=2))
+    out = main.tensor(shape)
+    main.op(tflite.BuiltinOperator.RELU, [loop], [out])
+    main.outputs.append(out)
+    return [main, cond, body]
+
+# single subgraph patterns; gen_while models go through tflite-bench.py --stress check_pool
+generators = {
+    'chain': gen_chain,
+    'branch': gen_branch,
+    'random': gen_random,
+}
@@ -1,37 +1,132 @@
+import itertools
+import numpy
+from csr import csr_rows
+
+# (1st op idx, op idx) of every fusion group member, in group order
+def group_members(mp):
+    grps = list(mp.fus_grps.items())
+    lens = [len(grp) for _, grp in grps]
+    orgs = numpy.repeat(numpy.array([org for org, _ in grps], dtype=numpy.int64), lens)
+    idxs = numpy.fromiter(itertools.chain.from_iterable(grp for _, grp in grps), dtype=numpy.int64, count=sum(lens))
+    return orgs, idxs
+
+def op_edges(mp):
+    src = csr_rows(mp.op_succ_ptr).astype(numpy.int64)
+    return src, mp.op_succ.astype(numpy.int64)
 
 def ut_next_successor(mp):
     errcnt = 0
-    for op in mp.ops:
-        if len(op.fus_grp) < 2:
-            continue
-        for i in range(len(op.fus_grp) - 1):
-            x = op.fus_grp[i]
-            y = op.fus_grp[i+1]
-            if y not in x.succ:
-                print('ERROR: %s not %s\'s successor' %(y.nodename(), x.nodename()))
-                errcnt += 1
+    num_ops = len(mp.ops)
+    orgs, idxs = group_members(mp)
+    same = orgs[1:] == orgs[:-1]
+    x, y = idxs[:-1][same], idxs[1:][same]
+    src, dst = op_edges(mp)
+    linked = numpy.isin(x * num_ops + y, src * num_ops + dst)
+    for a, b in zip(x[~linked].tolist(), y[~linked].tolist()):
+        print('ERROR: %s not %s\'s successor' %(mp.ops[b].nodename(), mp.ops[a].nodename()))
+        errcnt += 1
     return errcnt
 
 def ut_double_fused(mp):
     errcnt = 0
-    for op in mp.ops:
-        if op.fus_grp and op.fus_org:
-            print('ERROR: %s double fused %s %s' %(op.nodename(), str(op.fus_org.fus_idxs()), str(op.fus_idxs())))
-            errcnt += 1
+    for org_idx in sorted([org for org, grp in mp.fus_grps.items() if grp and mp.fus_org[org] >= 0]):
+        op = mp.ops[org_idx]
+        print('ERROR: %s double fused %s %s' %(op.nodename(), str(op.fus_org.fus_idxs()), str(op.fus_idxs())))
+        errcnt += 1
     return errcnt
 
 def ut_dependency(mp):
     errcnt = 0
-    executed = []
-    for op in mp.ops:
-        for fus_op in op.fus_grp:
-            for pred in fus_op.pred:
-                if pred.idx not in executed:
-                    print('ERROR: %s dependency failed, %s not ready' %(fus_op.nodename(), pred.nodename()))
+    pred_ptr = mp.op_pred_ptr.tolist()
+    pred = mp.op_pred.tolist()
+    executed = bytearray(len(mp.ops))
+    for op_idx in range(len(mp.ops)):
+        for fus_idx in mp.fus_grps.get(op_idx, []):
+            for pred_idx in pred[pred_ptr[fus_idx]:pred_ptr[fus_idx+1]]:
+                if not executed[pred_idx]:
+                    print('ERROR: %s dependency failed, %s not ready' %(mp.ops[fus_idx].nodename(), mp.ops[pred_idx].nodename()))
                     errcnt += 1
-            executed.append(fus_op.idx)
-        if op.idx not in executed:
-            executed.append(op.idx)
+            executed[fus_idx] = 1
+        executed[op_idx] = 1
+    return errcnt
+
+# every op in exactly one group, fus_org pointing to the group listing it
+def ut_coverage(mp):
+    errcnt = 0
+    orgs, idxs = group_members(mp)
+    count = numpy.bincount(idxs, minlength=len(mp.ops))
+    for op_idx in numpy.flatnonzero(count != 1).tolist():
+        print('ERROR: %s in %d fusion groups' %(mp.ops[op_idx].nodename(), count[op_idx]))
+        errcnt += 1
+    owner = numpy.where(idxs == orgs, -1, orgs)
+    for i in numpy.flatnonzero((mp.fus_org[idxs] != owner) & (count[idxs] == 1)).tolist():
+        print('ERROR: %s in group %d, fus_org %d' %(mp.ops[idxs[i]].nodename(), orgs[i], mp.fus_org[idxs[i]]))
+        errcnt += 1
+    return errcnt
+
+# groups are executed whole, so the graph of groups must be acyclic: groups left after
+# peeling sources, then sinks, lie on a cycle (or between two)
+def ut_group_cycle(mp):
+    errcnt = 0
+    num_ops = len(mp.ops)
+    key = mp.group_keys()
+    src, dst = op_edges(mp)
+    src, dst = key[src], key[dst]
+    cross = src != dst
+    pairs = numpy.unique(src[cross] * num_ops + dst[cross])
+    left = numpy.zeros(num_ops, dtype=bool)
+    left[key] = True
+    for a, b in ((pairs // num_ops, pairs % num_ops), (pairs % num_ops, pairs // num_ops)):
+        order = numpy.argsort(a, kind='stable')
+        a, b = a[order].tolist(), b[order].tolist()
+        ptr = numpy.searchsorted(a, numpy.arange(num_ops + 1)).tolist()
+        degree = [0] * num_ops
+        for x, y in zip(a, b):
+            if left[x] and left[y]:
+                degree[y] += 1
+        queue = [x for x in numpy.flatnonzero(left).tolist() if degree[x] == 0]
+        while queue:
+            x = queue.pop()
+            left[x] = False
+            for y in b[ptr[x]:ptr[x+1]]:
+                if left[y]:
+                    degree[y] -= 1
+                    if degree[y] == 0:
+                        queue.append(y)
+    for org_idx in numpy.flatnonzero(left).tolist():
+        print('ERROR: fusion group %s on a cycle of groups' %(mp.ops[org_idx].nodename()))
+        errcnt += 1
+    return errcnt
+
+# the ops of a group are connected through edges inside the group
+def ut_contiguity(mp):
+    errcnt = 0
+    num_ops = len(mp.ops)
+    key = mp.group_keys()
+    src, dst = op_edges(mp)
+    inner = key[src] == key[dst]
+    a = numpy.concatenate([src[inner], dst[inner]])
+    b = numpy.concatenate([dst[inner], src[inner]])
+    order = numpy.argsort(a, kind='stable')
+    b = b[order].tolist()
+    ptr = numpy.searchsorted(a[order], numpy.arange(num_ops + 1)).tolist()
+    comp = [-1] * num_ops
+    for op_idx in range(num_ops):
+        if comp[op_idx] >= 0:
+            continue
+        comp[op_idx] = op_idx
+        queue = [op_idx]
+        while queue:
+            x = queue.pop()
+            for y in b[ptr[x]:ptr[x+1]]:
+                if comp[y] < 0:
+                    comp[y] = op_idx
+                    queue.append(y)
+    pairs = numpy.unique(key * num_ops + numpy.array(comp))
+    num_comps = numpy.bincount(pairs // num_ops, minlength=num_ops)
+    for org_idx in numpy.flatnonzero(num_comps > 1).tolist():
+        print('ERROR: fusion group %s not connected, %d parts %s' %(mp.ops[org_idx].nodename(), num_comps[org_idx], str(mp.ops[org_idx].fus_idxs())))
+        errcnt += 1
     return errcnt
 
 def unit_test(mp):
@@ -39,5 +134,7 @@ def unit_test(mp):
     errcnt += ut_double_fused(mp)
     errcnt += ut_next_successor(mp)
     errcnt += ut_dependency(mp)
+    errcnt += ut_coverage(mp)
+    errcnt += ut_group_cycle(mp)
+    errcnt += ut_contiguity(mp)
     return errcnt
-
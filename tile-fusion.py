@@ -5,8 +5,10 @@ import re
 import configparser
 import argparse
 
-import matplotlib.pyplot as plt
-from matplotlib.patches import Rectangle
+import numpy
+import tile_sched
+
+# matplotlib is imported on demand (--plot / --output)
 
 class Pad:
     def __init__(self, left, right, top, bottom):
@@ -54,18 +56,65 @@ class Tile:
     def get_str(self):
         return '(%d, %d) %dx%d' %(self.x, self.y, self.w, self.h)
 
+# All tiles of a layer as int64 arrays, tiles[i] is Tile(x[i], y[i], w[i], h[i], tp[i])
+class Tiles:
+    def __init__(self, x, y, w, h, tp=None):
+        self.x = x
+        self.y = y
+        self.w = w
+        self.h = h
+        self.tp = tp
+    def __len__(self):
+        return len(self.x)
+    def get_tiles(self):
+        tps = self.tp.get_tiles() if self.tp else [None] * len(self)
+        return [Tile(*vals) for vals in zip(self.x.tolist(), self.y.tolist(), self.w.tolist(), self.h.tolist(), tps)]
+
+# Channel groups of a layer as arrays: channels [c[i], c[i] + n[i])
+class Channels:
+    def __init__(self, c, n):
+        self.c = c
+        self.n = n
+    def __len__(self):
+        return len(self.c)
+
+dtype_bytes = {
+    'bool': 1, 'int8': 1, 'uint8': 1, 'int16': 2, 'uint16': 2, 'float16': 2, 'bfloat16': 2,
+    'int32': 4, 'uint32': 4, 'float32': 4, 'int64': 8, 'float64': 8,
+}
+
 class Layer:
-    def __init__(self, w=0, h=0, out_w=0, out_h=0, flt=None, pad=None, pad_type=None):
+    def __init__(self, w=0, h=0, out_w=0, out_h=0, flt=None, pad=None, pad_type=None, c=1, out_c=1, groups=1, dtype='int8', batch=1):
         self.w = w
-        self.w = h
+        self.h = h
         self.out_w = out_w
         self.out_h = out_h
         self.flt = flt or Flt(1, 1, 1, 1)
         self.pad = pad or Pad(0, 0, 0, 0)
         self.pad_type = pad_type
+        self.c = c
+        self.out_c = out_c
+        self.groups = groups # c for depthwise / pooling
+        self.dtype = dtype
+        self.batch = batch
+    def elem_bytes(self):
+        return dtype_bytes[self.dtype]
+    # MACs per output element
+    def macs(self):
+        return self.flt.w * self.flt.h * max(self.c // self.groups, 1)
+    # input channels needed by groups of output channels
+    def get_channels_by_output(self, out_channels):
+        if self.groups == 1:
+            return Channels(numpy.zeros_like(out_channels.c), numpy.full_like(out_channels.n, self.c))
+        out_per_grp = max(self.out_c // self.groups, 1)
+        in_per_grp = max(self.c // self.groups, 1)
+        first = out_channels.c // out_per_grp
+        last = (out_channels.c + out_channels.n + out_per_grp - 1) // out_per_grp
+        return Channels(first * in_per_grp, (last - first) * in_per_grp)
     def set_pad_by_fo(self):
-        pad_w = (self.out_w - 1) * self.flt.sx + self.flt.w + (self.flt.w - 1) * (self.flt.dx - 1) - self.w
-        pad_h = (self.out_h - 1) * self.flt.sy + self.flt.h + (self.flt.h - 1) * (self.flt.dy - 1) - self.h
+        # as TFLite: no negative padding when strides skip the last columns / rows
+        pad_w = max((self.out_w - 1) * self.flt.sx + self.flt.w + (self.flt.w - 1) * (self.flt.dx - 1) - self.w, 0)
+        pad_h = max((self.out_h - 1) * self.flt.sy + self.flt.h + (self.flt.h - 1) * (self.flt.dy - 1) - self.h, 0)
         left = pad_w // 2
         right = pad_w - left
         top = pad_h // 2
@@ -112,14 +161,58 @@ class Layer:
             h = 0
             y = self.h
         return Tile(x, y, w, h, tp)
+    # get_output_tiles for all tiles at once
+    def get_output_tiles_np(self, tile_w, tile_h):
+        y, x = numpy.meshgrid(numpy.arange(0, self.out_h, tile_h), numpy.arange(0, self.out_w, tile_w), indexing='ij')
+        x = x.ravel()
+        y = y.ravel()
+        return Tiles(x, y, numpy.minimum(tile_w, self.out_w - x), numpy.minimum(tile_h, self.out_h - y))
+    # get_tiles_by_output for all tiles at once
+    def get_tiles_by_output_np(self, out_tiles):
+        # w/ paddings
+        x = out_tiles.x * self.flt.sx
+        y = out_tiles.y * self.flt.sy
+        w = (out_tiles.w - 1) * self.flt.sx + self.flt.w + (self.flt.w - 1) * (self.flt.dx - 1)
+        h = (out_tiles.h - 1) * self.flt.sy + self.flt.h + (self.flt.h - 1) * (self.flt.dy - 1)
+        if self.pad.left == 0 and self.pad.right == 0 and self.pad.top == 0 and self.pad.bottom == 0:
+            return Tiles(x, y, w, h)
+        tp = Tiles(x, y, w, h)
+        # w/o paddings
+        x, w = self.clamp_np(x, w, self.pad.left, self.w)
+        y, h = self.clamp_np(y, h, self.pad.top, self.h)
+        return Tiles(x, y, w, h, tp)
+    # position / length along one axis without the leading padding, as in get_tiles_by_output
+    @staticmethod
+    def clamp_np(pos, size, pad, dim):
+        before = pos < pad
+        inside = ~before & (pos <= pad + dim)
+        new_size = numpy.where(before, numpy.maximum(numpy.minimum(pos + size - pad, dim), 0),
+            numpy.where(inside, numpy.minimum(size, pad + dim - pos), 0))
+        new_pos = numpy.where(before, 0, numpy.where(inside, pos - pad, dim))
+        return new_pos, new_size
     def parse_desc(self, desc):
-        m = re.search('in=(\d+)x(\d+)', desc)
+        m = re.search(r'in=(\d+)x(\d+)(x(\d+))?', desc)
         if m:
             self.w, self.h = int(m.group(1)), int(m.group(2))
-        m = re.search('out=(\d+)x(\d+)', desc)
+            if m.group(4):
+                self.c = int(m.group(4))
+        m = re.search(r'out=(\d+)x(\d+)(x(\d+))?', desc)
         if m:
             self.out_w, self.out_h = int(m.group(1)), int(m.group(2))
-        m = re.search('pad_type=(\w+)', desc)
+            if m.group(4):
+                self.out_c = int(m.group(4))
+        m = re.search(r'groups=(\d+)', desc)
+        if m:
+            self.groups = int(m.group(1))
+        m = re.search(r'dtype=(\w+)', desc)
+        if m:
+            if m.group(1) not in dtype_bytes:
+                raise ValueError('unknown dtype %s' %(m.group(1)))
+            self.dtype = m.group(1)
+        m = re.search(r'batch=(\d+)', desc)
+        if m:
+            self.batch = int(m.group(1))
+        m = re.search(r'pad_type=(\w+)', desc)
         if m:
             self.pad_type = m.group(1)
         self.flt.parse_desc(desc)
@@ -137,15 +230,17 @@ class LoadConfig(argparse.Action):
         cfg.read(values)
         for k in cfg['tile-fusion']:
             if k in ['layer']:
-                vals = re.split('\s| ', cfg['tile-fusion'][k].strip())
+                vals = re.split(r'\s| ', cfg['tile-fusion'][k].strip())
                 setattr(namespace, k, vals)
-            elif k in ['plot']:
+            elif k in ['plot', 'search', 'line_buffer']:
                 setattr(namespace, k, str2bool(cfg['tile-fusion'][k]))
+            elif k in ['sram', 'channel_tile', 'cores', 'core_macs', 'bandwidth']:
+                setattr(namespace, k, int(cfg['tile-fusion'][k]))
             else:
                 setattr(namespace, k, cfg['tile-fusion'][k])
 
 # Note: Number of tiles_by_layer = Number of layers + last output
-def do_tile_fusion(layers, last_output_tile_w, last_output_tile_h):
+def do_tile_fusion(layers, last_output_tile_w, last_output_tile_h, verbose=True):
     tiles_by_layer = []
     # tiling from bottom up
     tiles_by_layer.insert(0, layers[-1].get_output_tiles(last_output_tile_w, last_output_tile_h))
@@ -155,6 +250,9 @@ def do_tile_fusion(layers, last_output_tile_w, last_output_tile_h):
             tiles.append(layer.get_tiles_by_output(out_tile))
         tiles_by_layer.insert(0, tiles)
 
+    if not verbose:
+        return tiles_by_layer
+
     print('-' * 80)
     for idx, layer in enumerate(layers):
         print('layer {}'.format(idx))
@@ -169,50 +267,196 @@ def do_tile_fusion(layers, last_output_tile_w, last_output_tile_h):
 
     return tiles_by_layer
 
-def do_plot(layers, tiles_by_layer):
+# do_tile_fusion on Tiles arrays, without the dump
+def do_tile_fusion_np(layers, last_output_tile_w, last_output_tile_h):
+    tiles_by_layer = [layers[-1].get_output_tiles_np(last_output_tile_w, last_output_tile_h)]
+    for layer in layers[::-1]:
+        tiles_by_layer.insert(0, layer.get_tiles_by_output_np(tiles_by_layer[0]))
+    return tiles_by_layer
+
+# Groups of channel_tile output channels of the last layer (0: all channels), back through the chain.
+# Note: Number of channels_by_layer = Number of layers + last output
+def do_channel_tiling(layers, channel_tile=0):
+    out_c = layers[-1].out_c
+    c = numpy.arange(0, out_c, channel_tile or out_c)
+    channels_by_layer = [Channels(c, numpy.minimum(channel_tile or out_c, out_c - c))]
+    for layer in layers[::-1]:
+        channels_by_layer.insert(0, layer.get_channels_by_output(channels_by_layer[0]))
+    return channels_by_layer
 
-    fig = plt.figure(figsize=(80, 80))
+# bytes of every (tile, channel group) pair of a layer's input and output, tiles x groups
+def tile_bytes(layer, area, out_area, channels, out_channels):
+    return (numpy.outer(area, channels.n) + numpy.outer(out_area, out_channels.n)) * layer.elem_bytes()
+
+# Cost of one output tile size, tiles visited per channel group and batch:
+# buffer: largest input + output tile of any layer (bytes), compute: MACs incl. recomputed halos
+# and inputs fetched again for every channel group, dram: first layer input reads (bytes)
+class TileCost:
+    def __init__(self, tile_w, tile_h, layers, tiles_by_layer, channels_by_layer=None):
+        channels_by_layer = channels_by_layer or do_channel_tiling(layers)
+        self.tile_w = tile_w
+        self.tile_h = tile_h
+        self.buffer = 0
+        self.compute = 0
+        for idx, layer in enumerate(layers):
+            tiles, next_tiles = tiles_by_layer[idx], tiles_by_layer[idx+1]
+            next_area = next_tiles.w * next_tiles.h
+            footprint = tile_bytes(layer, tiles.w * tiles.h, next_area, channels_by_layer[idx], channels_by_layer[idx+1])
+            self.buffer = max(self.buffer, int(footprint.max(initial=0)))
+            self.compute += int(next_area.sum()) * int(channels_by_layer[idx+1].n.sum()) * layer.macs() * layer.batch
+        layer = layers[0]
+        self.dram = int((tiles_by_layer[0].w * tiles_by_layer[0].h).sum()) * int(channels_by_layer[0].n.sum()) * layer.elem_bytes() * layer.batch
+        ideal_compute = sum([x.out_w * x.out_h * x.out_c * x.macs() * x.batch for x in layers])
+        ideal_dram = layer.w * layer.h * layer.c * layer.elem_bytes() * layer.batch
+        self.recompute = float(self.compute) / ideal_compute - 1 if ideal_compute else 0.0
+        self.reread = float(self.dram) / ideal_dram - 1 if ideal_dram else 0.0
+    def get_str(self):
+        return '%dx%d buffer %d recompute %.1f%% dram reads %d (+%.1f%%)' %(
+            self.tile_w, self.tile_h, self.buffer, self.recompute * 100, self.dram, self.reread * 100)
+
+# (x0, y0, x1, y1) of tiles clipped to a w x h layer
+def tile_rects(tiles, w, h):
+    x0 = numpy.minimum(tiles.x, w)
+    y0 = numpy.minimum(tiles.y, h)
+    return x0, y0, numpy.clip(tiles.x + tiles.w, x0, w), numpy.clip(tiles.y + tiles.h, y0, h)
+
+def intersect_area(a, b):
+    return numpy.maximum(numpy.minimum(a[2], b[2]) - numpy.maximum(a[0], b[0]), 0) * \
+        numpy.maximum(numpy.minimum(a[3], b[3]) - numpy.maximum(a[1], b[1]), 0)
+
+# Input side of one layer over all tiles and channel groups, in bytes:
+# fetched vs unique input (overlapping halos are fetched, or recomputed upstream, once per tile),
+# buffer: input + output tile per tile. With line_buffer, tiles are visited row-major and the halo
+# shared with the left tile and the line above is kept on chip instead of being fetched again.
+class LayerStats:
+    def __init__(self, layer, tiles, out_tiles, channels, out_channels, cols, line_buffer=False):
+        rect = tile_rects(tiles, layer.w, layer.h)
+        area = (rect[2] - rect[0]) * (rect[3] - rect[1])
+        # coverage count by 2D prefix sums of the rectangle corners
+        cov = numpy.zeros((layer.h + 1, layer.w + 1), dtype=numpy.int64)
+        for sign, ys, xs in ((1, rect[1], rect[0]), (-1, rect[1], rect[2]), (-1, rect[3], rect[0]), (1, rect[3], rect[2])):
+            numpy.add.at(cov, (ys, xs), sign)
+        scale = layer.elem_bytes() * layer.batch
+        self.unique = int(numpy.count_nonzero(cov.cumsum(0).cumsum(1))) * layer.c * scale
+        self.fetched = int(area.sum()) * int(channels.n.sum()) * scale
+        footprint = tile_bytes(layer, area, out_tiles.w * out_tiles.h, channels, out_channels)
+        self.buffer = int(footprint.max(initial=0))
+        self.buffer_avg = float(footprint.mean()) if len(footprint) else 0.0
+        self.line_buffer = line_buffer
+        if line_buffer:
+            idx = numpy.arange(len(tiles))
+            left = numpy.where(idx % cols > 0, idx - 1, idx)
+            up = numpy.where(idx >= cols, idx - cols, idx)
+            left_rect = [numpy.where(left < idx, v[left], 0) for v in rect]
+            up_rect = [numpy.where(up < idx, v[up], 0) for v in rect]
+            both = [numpy.maximum(left_rect[0], up_rect[0]), numpy.maximum(left_rect[1], up_rect[1]),
+                numpy.minimum(left_rect[2], up_rect[2]), numpy.minimum(left_rect[3], up_rect[3])]
+            kept = intersect_area(rect, left_rect) + intersect_area(rect, up_rect) - intersect_area(rect, both)
+            self.fetched_lb = int((area - kept).sum()) * int(channels.n.sum()) * scale
+            # halo rows over the full width, halo columns over a tile height
+            halo_h = numpy.maximum(numpy.minimum(rect[3], up_rect[3]) - rect[1], 0) * (up < idx)
+            halo_w = numpy.maximum(numpy.minimum(rect[2], left_rect[2]) - rect[0], 0) * (left < idx)
+            self.line_buffer_size = (int(halo_h.max(initial=0)) * layer.w + int((halo_w * (rect[3] - rect[1])).max(initial=0))) * \
+                int(channels.n.max(initial=0)) * layer.elem_bytes()
+    def recompute(self):
+        return float(self.fetched) / self.unique - 1 if self.unique else 0.0
+    def get_str(self):
+        msg = 'fetched %d unique %d (+%.1f%%) buffer max %d avg %.0f' %(
+            self.fetched, self.unique, self.recompute() * 100, self.buffer, self.buffer_avg)
+        if self.line_buffer:
+            msg += ', line buffer: fetched %d (-%.1f%%) +%d buffer' %(
+                self.fetched_lb, 100.0 * (self.fetched - self.fetched_lb) / self.fetched if self.fetched else 0.0, self.line_buffer_size)
+        return msg
+
+def do_tile_stats(layers, tiles_by_layer, last_output_tile_w, line_buffer=False, channels_by_layer=None):
+    channels_by_layer = channels_by_layer or do_channel_tiling(layers)
+    cols = (layers[-1].out_w + last_output_tile_w - 1) // last_output_tile_w # tiles per row
+    return [LayerStats(layer, tiles_by_layer[idx], tiles_by_layer[idx+1], channels_by_layer[idx], channels_by_layer[idx+1], cols, line_buffer)
+        for idx, layer in enumerate(layers)]
+
+# tile sizes giving distinct tile counts along a dimension of n pixels
+def tile_candidates(n):
+    return sorted(set([(n + k - 1) // k for k in range(1, n + 1)]))
+
+# Output tile sizes whose buffer fits sram, Pareto-optimal in (buffer, compute, dram), by buffer size
+def search_tile_dim(layers, sram, channel_tile=0):
+    channels_by_layer = do_channel_tiling(layers, channel_tile)
+    costs = []
+    for tile_w in tile_candidates(layers[-1].out_w):
+        for tile_h in tile_candidates(layers[-1].out_h):
+            cost = TileCost(tile_w, tile_h, layers, do_tile_fusion_np(layers, tile_w, tile_h), channels_by_layer)
+            if cost.buffer <= sram:
+                costs.append(cost)
+    pareto = []
+    for cost in sorted(costs, key=lambda x: (x.buffer, x.compute, x.dram)):
+        # any kept one has buffer <= cost.buffer
+        if not [x for x in pareto if x.compute <= cost.compute and x.dram <= cost.dram]:
+            pareto.append(cost)
+    return pareto
+
+# Outlines of tiles with a nonzero area as closed polylines, offset by (x, y)
+def tile_segments(tiles, x, y):
+    tiles = Tiles(*[v[(tiles.w > 0) & (tiles.h > 0)] for v in (tiles.x, tiles.y, tiles.w, tiles.h)])
+    x0 = tiles.x + x
+    y0 = tiles.y + y
+    x1 = x0 + tiles.w
+    y1 = y0 + tiles.h
+    return numpy.stack([numpy.stack([x0, x1, x1, x0, x0], 1), numpy.stack([y0, y0, y1, y1, y0], 1)], 2), tiles
+
+# One LineCollection per layer; tiles are labelled only up to max_labels per layer, otherwise summarized.
+# Writes to output (.png, .svg, ...) without a display if given, shows the plot otherwise.
+def do_plot(layers, tiles_by_layer, output=None, max_labels=64):
+    import matplotlib
+    if output:
+        matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    from matplotlib.collections import LineCollection
+
+    total_w = sum([layer.get_dim_with_padding()[0] + 10 for layer in layers]) + layers[-1].out_w
+    max_h = max([layer.get_dim_with_padding()[1] for layer in layers] + [layers[-1].out_h])
+    fig = plt.figure(figsize=(min(max(total_w / 50.0, 8), 40), min(max(max_h / 50.0, 6), 40)))
     ax = fig.add_subplot()
 
+    def draw_tiles(tiles, x, y):
+        segments, tiles = tile_segments(tiles, x, y)
+        ax.add_collection(LineCollection(segments, colors='red', linestyles=':'))
+        if len(tiles) > max_labels:
+            ax.text(x, y, '{} tiles, {}x{} .. {}x{}'.format(len(tiles), tiles.w.max(), tiles.h.max(), tiles.w.min(), tiles.h.min()), va='top', bbox=dict(facecolor='white'))
+            return
+        for tile in tiles.get_tiles():
+            ax.text(x + tile.x, y + tile.y, '({},{}) {}x{}'.format(tile.x, tile.y, tile.w, tile.h), va='top', fontsize=8)
+
     # draw layers
     x = 0
     y = 0
-    max_h = 0
+    frames = []
     for idx, layer in enumerate(layers):
-        # w/ padding
+        # w/ padding, w/o padding
         w, h = layer.get_dim_with_padding()
-        ax.add_patch(Rectangle((x, y), w, h, color = 'black', fill=False))
-        # w/o padding
-        pos = (x + layer.pad.left, y + layer.pad.top)
-        ax.add_patch(Rectangle(pos, layer.w, layer.h, color='blue', fill=False))
-        plt.text(x, -10, 'layer {}x{} (pad: {}x{})\nflt {}x{} stride {}x{} dilation {}x{}'.format(
-            layer.w, layer.h, w, h,
+        frames.append(tile_segments(Tiles(*[numpy.array([v]) for v in (x, y, w, h)]), 0, 0)[0][0])
+        ax.add_collection(LineCollection(tile_segments(Tiles(*[numpy.array([v]) for v in (layer.pad.left, layer.pad.top, layer.w, layer.h)]), x, y)[0], colors='blue'))
+        ax.text(x, -10, 'layer {}x{}x{} (pad: {}x{})\nflt {}x{} stride {}x{} dilation {}x{}'.format(
+            layer.w, layer.h, layer.c, w, h,
             layer.flt.w, layer.flt.h,
             layer.flt.sx, layer.flt.sy,
-            layer.flt.dx, layer.flt.dy))
-        for tile_idx, tile in enumerate(tiles_by_layer[idx]):
-            if tile.w and tile.h:
-                pos = (x + layer.pad.left + tile.x, y + layer.pad.top + tile.y)
-                ax.add_patch(Rectangle(pos, tile.w, tile.h, color = 'red', ls=':', fill=False))
-                plt.text(pos[0], pos[1], 'tile-{} ({},{}) {}x{}'.format(tile_idx, tile.x, tile.y, tile.w, tile.h))
+            layer.flt.dx, layer.flt.dy), fontsize=8)
+        draw_tiles(tiles_by_layer[idx], x + layer.pad.left, y + layer.pad.top)
         x += w + 10
-        max_h = max(max_h, h)
 
     # last output
-    w, h = layers[-1].out_w, layers[-1].out_h
-    ax.add_patch(Rectangle((x, y), w, h, color = 'black', fill=False))
-    for tile_idx, tile in enumerate(tiles_by_layer[-1]):
-        if tile.w and tile.h:
-            pos = (x + tile.x, y + tile.y)
-            ax.add_patch(Rectangle(pos, tile.w, tile.h, color = 'red', ls=':', fill=False))
-            plt.text(pos[0], pos[1], 'tile-{} ({},{}) {}x{}'.format(tile_idx, tile.x, tile.y, tile.w, tile.h))
-    x += w
-
-    # display plot
-    plt.xlim(0, x)
-    plt.ylim(0, max_h)
-    plt.gca().invert_yaxis()
-    plt.show()
+    frames.append(tile_segments(Tiles(*[numpy.array([v]) for v in (x, y, layers[-1].out_w, layers[-1].out_h)]), 0, 0)[0][0])
+    draw_tiles(tiles_by_layer[-1], x, y)
+    ax.add_collection(LineCollection(frames, colors='black'))
+    x += layers[-1].out_w
+
+    ax.set_xlim(0, x)
+    ax.set_ylim(max_h, -20)
+    ax.set_aspect('equal')
+    if output:
+        fig.savefig(output)
+        plt.close(fig)
+    else:
+        plt.show()
 
     return
 
@@ -232,9 +476,17 @@ def main():
     parser.add_argument('-l', '--layer', nargs='+')
     parser.add_argument('-t', '--tile_dim')
     parser.add_argument('-p', '--plot', type=str2bool, nargs='?', const=True, default=False)
+    parser.add_argument('-o', '--output', help='write the plot to a .png / .svg file instead of showing it')
+    parser.add_argument('-s', '--search', type=str2bool, nargs='?', const=True, default=False, help='search tile_dim under --sram')
+    parser.add_argument('--sram', type=int, default=65536, help='on-chip buffer, bytes')
+    parser.add_argument('--channel_tile', type=int, default=0, help='output channels per channel group, 0: all')
+    parser.add_argument('--cores', type=int, default=0, help='simulate tiles on N cores')
+    parser.add_argument('--core_macs', type=int, default=tile_sched.defvals.macs, help='MACs per cycle per core')
+    parser.add_argument('--bandwidth', type=int, default=tile_sched.defvals.bandwidth, help='DRAM bytes per cycle, shared')
+    parser.add_argument('--line_buffer', type=str2bool, nargs='?', const=True, default=False, help='keep halos between tiles on chip')
     args = parser.parse_args()
 
-    for k in ['layer', 'tile_dim']:
+    for k in ['layer'] if args.search else ['layer', 'tile_dim']:
         if not getattr(args, k):
             print('invalid {}'.format(k))
             return
@@ -247,18 +499,53 @@ def main():
     print('-' * 80)
     for idx, layer in enumerate(layers):
         msg = []
-        msg.append('in %dx%d' %(layer.w, layer.h))
+        msg.append('in %dx%dx%d' %(layer.w, layer.h, layer.c))
         msg.append('pad %dx%d (%d, %d, %d, %d)' %(
             layer.w + layer.pad.left + layer.pad.right, layer.h + layer.pad.top + layer.pad.bottom,
             layer.pad.left, layer.pad.right, layer.pad.top, layer.pad.bottom))
-        msg.append('out %dx%d' %(layer.out_w, layer.out_h))
-        print('layer %d : %s' %(idx, ' -> '.join(msg)))
+        msg.append('out %dx%dx%d' %(layer.out_w, layer.out_h, layer.out_c))
+        print('layer %d : %s (%s, batch %d, groups %d)' %(idx, ' -> '.join(msg), layer.dtype, layer.batch, layer.groups))
+
+    channels_by_layer = do_channel_tiling(layers, args.channel_tile)
+    if args.channel_tile:
+        print('-' * 80)
+        for grp_idx in range(len(channels_by_layer[-1])):
+            msg = ['[%d, %d)' %(x.c[grp_idx], x.c[grp_idx] + x.n[grp_idx]) for x in channels_by_layer]
+            print('channels %d : %s' %(grp_idx, ' -> '.join(msg)))
+
+    if args.search:
+        pareto = search_tile_dim(layers, args.sram, args.channel_tile)
+        print('-' * 80)
+        print('pareto tile_dim (sram %d)' %(args.sram))
+        for cost in pareto:
+            print('\t' + cost.get_str())
+        if not pareto:
+            print('\tnone fits')
+            return
+        best = min(pareto, key=lambda x: (x.compute, x.dram, x.buffer))
+        args.tile_dim = '%dx%d' %(best.tile_w, best.tile_h)
 
     tile_dim = list(map(int, args.tile_dim.split('x')))
-    tiles_by_layer = do_tile_fusion(layers, tile_dim[0], tile_dim[1])
+    do_tile_fusion(layers, tile_dim[0], tile_dim[1])
+    tiles_by_layer = do_tile_fusion_np(layers, tile_dim[0], tile_dim[1])
+
+    print('-' * 80)
+    stats = do_tile_stats(layers, tiles_by_layer, tile_dim[0], args.line_buffer, channels_by_layer)
+    for idx, layer_stats in enumerate(stats):
+        print('layer %d : %s' %(idx, layer_stats.get_str()))
+
+    if args.cores:
+        print('-' * 80)
+        cols = (layers[-1].out_w + tile_dim[0] - 1) // tile_dim[0]
+        work = tile_sched.TileWork(layers, tiles_by_layer, channels_by_layer, cols)
+        for scheme in tile_sched.schemes:
+            sim = tile_sched.Simulation(work, scheme, args.cores, args.core_macs, args.bandwidth)
+            print(sim.get_str())
+            for idx, core in enumerate(sim.cores):
+                print('\tcore %d : %d tiles, busy %d cycles, buffer peak %d' %(idx, core.tiles, core.busy, core.buffer_peak))
 
-    if args.plot:
-        do_plot(layers, tiles_by_layer)
+    if args.plot or args.output:
+        do_plot(layers, tiles_by_layer, args.output)
 
     return
 
@@ -0,0 +1,139 @@
+#!/usr/bin/python3
+
+import collections
+import numpy
+
+class defvals:
+    cores = 4
+    macs = 256 # MACs per cycle per core
+    bandwidth = 64 # DRAM bytes per cycle, shared by all cores
+
+schemes = ('row', 'column', 'steal')
+
+# Work of every (channel group, tile, batch) item of a tiled layer chain (Tiles / Channels arrays of
+# tile-fusion.py), bytes and MACs: rd: 1st layer input fetched, wr: last output written, macs: all layers,
+# buffer: largest input + output tile. Items are ordered batch, channel group, then tiles row-major.
+class TileWork:
+    def __init__(self, layers, tiles_by_layer, channels_by_layer, cols):
+        num_tiles = len(tiles_by_layer[-1])
+        num_grps = len(channels_by_layer[-1])
+        self.macs = numpy.zeros((num_grps, num_tiles), dtype=numpy.int64)
+        self.buffer = numpy.zeros((num_grps, num_tiles), dtype=numpy.int64)
+        for idx, layer in enumerate(layers):
+            in_area = self.area(tiles_by_layer[idx], layer.w, layer.h)
+            out_area = tiles_by_layer[idx+1].w * tiles_by_layer[idx+1].h
+            in_ch, out_ch = channels_by_layer[idx].n, channels_by_layer[idx+1].n
+            self.macs += numpy.outer(out_ch, out_area) * layer.macs()
+            self.buffer = numpy.maximum(self.buffer, (numpy.outer(in_ch, in_area) + numpy.outer(out_ch, out_area)) * layer.elem_bytes())
+        self.rd = numpy.outer(channels_by_layer[0].n, self.area(tiles_by_layer[0], layers[0].w, layers[0].h)) * layers[0].elem_bytes()
+        self.wr = numpy.outer(channels_by_layer[-1].n, tiles_by_layer[-1].w * tiles_by_layer[-1].h) * layers[-1].elem_bytes()
+        self.cols = cols # tiles per row
+        self.col = numpy.tile(numpy.arange(num_tiles) % cols, num_grps * layers[0].batch)
+        for k in ('macs', 'buffer', 'rd', 'wr'):
+            setattr(self, k, numpy.tile(getattr(self, k).ravel(), layers[0].batch))
+    @staticmethod
+    def area(tiles, w, h):
+        x0 = numpy.minimum(tiles.x, w)
+        y0 = numpy.minimum(tiles.y, h)
+        return (numpy.clip(tiles.x + tiles.w, x0, w) - x0) * (numpy.clip(tiles.y + tiles.h, y0, h) - y0)
+    def __len__(self):
+        return len(self.macs)
+
+# item queue of every core, in TileWork order
+def assign_tiles(work, scheme, num_cores):
+    tiles = numpy.arange(len(work))
+    if scheme == 'row': # round-robin
+        return [collections.deque(tiles[c::num_cores].tolist()) for c in range(num_cores)]
+    if scheme == 'column': # contiguous column strips
+        strip = numpy.searchsorted(numpy.cumsum([len(x) for x in numpy.array_split(numpy.arange(work.cols), num_cores)]),
+            work.col, side='right')
+        return [collections.deque(tiles[strip == c].tolist()) for c in range(num_cores)]
+    if scheme == 'steal': # contiguous chunks, idle cores steal from the back of the longest queue
+        return [collections.deque(x.tolist()) for x in numpy.array_split(tiles, num_cores)]
+    raise ValueError('unknown scheme %s' %(scheme))
+
+class Core:
+    def __init__(self, queue):
+        self.queue = queue
+        self.tile = None
+        self.phase = None # 'rd', 'compute', 'wr' or None when done
+        self.remaining = 0.0 # bytes left for rd / wr, cycles left for compute
+        self.tiles = 0
+        self.busy = 0.0 # completion time of the last tile
+        self.dram_time = 0.0
+        self.buffer_peak = 0
+
+# Each core reads a tile's input, computes the whole chain, then writes the output; DRAM bandwidth is
+# shared evenly by the cores transferring at the same time
+class Simulation:
+    def __init__(self, work, scheme, num_cores=None, macs=None, bandwidth=None):
+        self.work = work
+        self.scheme = scheme
+        self.num_cores = num_cores or defvals.cores
+        self.macs = macs or defvals.macs
+        self.bandwidth = bandwidth or defvals.bandwidth
+        self.cores = [Core(queue) for queue in assign_tiles(work, scheme, self.num_cores)]
+        self.makespan = 0.0
+        self.run()
+
+    def next_tile(self, core):
+        if not core.queue and self.scheme == 'steal':
+            victim = max(self.cores, key=lambda x: len(x.queue))
+            if victim.queue:
+                core.queue.append(victim.queue.pop())
+        if not core.queue:
+            core.phase = None
+            return
+        core.tile = core.queue.popleft()
+        core.phase = 'rd'
+        core.remaining = float(self.work.rd[core.tile])
+        core.buffer_peak = max(core.buffer_peak, int(self.work.buffer[core.tile]))
+
+    def advance(self, core, now):
+        if core.phase == 'rd':
+            core.phase = 'compute'
+            core.remaining = float(self.work.macs[core.tile]) / self.macs
+        elif core.phase == 'compute':
+            core.phase = 'wr'
+            core.remaining = float(self.work.wr[core.tile])
+        else:
+            core.tiles += 1
+            core.busy = now
+            self.next_tile(core)
+
+    def run(self):
+        now = 0.0
+        for core in self.cores:
+            self.next_tile(core)
+        active = [x for x in self.cores if x.phase]
+        while active:
+            dram = [x for x in active if x.phase != 'compute']
+            rate = self.bandwidth / len(dram) if dram else 0.0
+            dt = min([x.remaining / rate if x.phase != 'compute' else x.remaining for x in active])
+            now += dt
+            for core in active:
+                if core.phase == 'compute':
+                    core.remaining -= dt
+                else:
+                    core.remaining -= rate * dt
+                    core.dram_time += dt
+                while core.phase and core.remaining <= 1e-9:
+                    self.advance(core, now)
+            active = [x for x in self.cores if x.phase]
+        self.makespan = now
+
+    def imbalance(self):
+        busy = [x.busy for x in self.cores]
+        mean = sum(busy) / len(busy)
+        return max(busy) / mean - 1 if mean else 0.0
+
+    # share of DRAM time spent waiting for other cores
+    def dram_wait(self):
+        dram_time = sum([x.dram_time for x in self.cores])
+        ideal = float(self.work.rd.sum() + self.work.wr.sum()) / self.bandwidth
+        return 1 - ideal / dram_time if dram_time else 0.0
+
+    def get_str(self):
+        return '%-6s makespan %d cycles, imbalance %.1f%%, dram wait %.1f%%, buffer peak %d' %(
+            self.scheme, self.makespan, self.imbalance() * 100, self.dram_wait() * 100,
+            max([x.buffer_peak for x in self.cores]))